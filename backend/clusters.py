@@ -0,0 +1,106 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# Clusters are cells of roughly this many screen pixels at each zoom level
+CLUSTER_CELL_PX = 64
+TILE_PX = 256
+# Above this zoom every hospital is returned on its own
+MAX_CLUSTER_ZOOM = 13
+
+
+def mercator(lat: np.ndarray, lng: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Web Mercator coordinates in [0, 1), the projection Leaflet tiles use."""
+    x = (np.asarray(lng, dtype=float) + 180.0) / 360.0
+    sin = np.sin(np.radians(np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511)))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+    return x, y
+
+
+class ZoomLevel:
+    """Hospitals grouped into grid cells for one zoom: members of a cell are contiguous in `order`."""
+
+    def __init__(self, zoom: int, x: np.ndarray, y: np.ndarray, lat: np.ndarray, lng: np.ndarray):
+        cells_per_side = TILE_PX * 2 ** zoom // CLUSTER_CELL_PX
+        cx = np.minimum((x * cells_per_side).astype(np.int64), cells_per_side - 1)
+        cy = np.minimum((y * cells_per_side).astype(np.int64), cells_per_side - 1)
+        keys = cy * cells_per_side + cx
+        self.order = np.argsort(keys, kind="stable").astype(np.int32)
+        sorted_keys = keys[self.order]
+        self.starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(keys) else np.empty(0, np.int64)
+        self.counts = np.diff(np.r_[self.starts, len(keys)])
+        # Unfiltered centroids, used to pick the cells that fall inside a viewport
+        if len(keys):
+            self.lat = np.add.reduceat(lat[self.order], self.starts) / self.counts
+            self.lng = np.add.reduceat(lng[self.order], self.starts) / self.counts
+        else:
+            self.lat = self.lng = np.empty(0)
+
+
+class ClusterIndex:
+    """
+    Hierarchical grid over hospital coordinates, one ZoomLevel per zoom up to MAX_CLUSTER_ZOOM.
+
+    Only geometry is precomputed, so the index can be shared by snapshots whose hospitals
+    did not move. Wait aggregates are reduced per request over the members of the cells in
+    the viewport, which bounds both work and payload by what is on screen.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray):
+        self.lat = np.asarray(lat, dtype=float)
+        self.lng = np.asarray(lng, dtype=float)
+        x, y = mercator(self.lat, self.lng)
+        self.levels = [ZoomLevel(z, x, y, self.lat, self.lng) for z in range(MAX_CLUSTER_ZOOM + 1)]
+
+    def query(self, bbox: Tuple[float, float, float, float], zoom: int, waits: np.ndarray,
+              mask: Optional[np.ndarray] = None) -> List[dict]:
+        """
+        Clusters inside `bbox` (west, south, east, north) with count, centroid and
+        min/avg/max of `waits`. Cells with a single hospital carry its `row` instead.
+        `mask` optionally restricts which rows count (e.g. one province).
+        """
+        west, south, east, north = bbox
+        if zoom > MAX_CLUSTER_ZOOM:
+            inside = (self.lat >= south) & (self.lat <= north) & (self.lng >= west) & (self.lng <= east)
+            if mask is not None:
+                inside &= mask
+            return [
+                {"row": int(row), "lat": float(self.lat[row]), "lng": float(self.lng[row]), "count": 1,
+                 "min": int(waits[row]), "avg": float(waits[row]), "max": int(waits[row])}
+                for row in np.flatnonzero(inside)
+            ]
+
+        level = self.levels[max(zoom, 0)]
+        cells = np.flatnonzero((level.lat >= south) & (level.lat <= north) & (level.lng >= west) & (level.lng <= east))
+        if len(cells) == 0:
+            return []
+
+        # Gather the members of the selected cells into one contiguous run per cell
+        counts = level.counts[cells]
+        starts = level.starts[cells]
+        new_starts = np.r_[0, np.cumsum(counts)[:-1]]
+        offsets = np.arange(counts.sum()) - np.repeat(new_starts - starts, counts)
+        members = level.order[offsets]
+
+        keep = np.ones(len(members), dtype=bool) if mask is None else mask[members]
+        values = waits[members].astype(np.int64)
+        n = np.add.reduceat(keep.astype(np.int64), new_starts)
+        big = np.iinfo(np.int64).max
+        lo = np.minimum.reduceat(np.where(keep, values, big), new_starts)
+        hi = np.maximum.reduceat(np.where(keep, values, -big), new_starts)
+        total = np.add.reduceat(np.where(keep, values, 0), new_starts)
+        lat_sum = np.add.reduceat(np.where(keep, self.lat[members], 0.0), new_starts)
+        lng_sum = np.add.reduceat(np.where(keep, self.lng[members], 0.0), new_starts)
+        # The single remaining member of a cell: the largest kept index within its run
+        last_kept = np.maximum.reduceat(np.where(keep, np.arange(len(members)), -1), new_starts)
+
+        clusters = []
+        for i in np.flatnonzero(n > 0):
+            cluster = {
+                "lat": float(lat_sum[i] / n[i]), "lng": float(lng_sum[i] / n[i]), "count": int(n[i]),
+                "min": int(lo[i]), "avg": round(float(total[i] / n[i]), 1), "max": int(hi[i]),
+            }
+            if n[i] == 1:
+                cluster["row"] = int(members[last_kept[i]])
+            clusters.append(cluster)
+        return clusters
@@ -0,0 +1,124 @@
+"""
+Location of the SQLite database the API serves.
+
+The scheduler (backend/scheduler.py) never writes to the database in use: it builds the
+next dataset in a new file and then publishes it by rewriting a small pointer file,
+`data/current_db`. Renaming over an open database is not possible on Windows, a pointer
+is; readers switch on their next version check and the old file is removed later.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+DATA_DIR = "data"
+DEFAULT_DB = "saniradar.db"
+POINTER_FILE = os.path.join(DATA_DIR, "current_db")
+
+# Starlette runs sync endpoints and dependencies in a pool of 40 threads: one read connection each
+READ_POOL_SIZE = int(os.environ.get("SANIRADAR_READ_POOL", 40))
+
+# WAL lets readers keep going while the writer commits; NORMAL is durable enough in WAL mode
+WRITE_PRAGMAS = ("PRAGMA journal_mode=WAL", "PRAGMA synchronous=NORMAL", "PRAGMA busy_timeout=5000")
+# mmap is shared through the OS page cache, so it is large; the private page cache is per connection
+READ_PRAGMAS = ("PRAGMA mmap_size=268435456", "PRAGMA cache_size=-16384", "PRAGMA query_only=ON")
+
+# How long write_lock waits for another process's schema upgrade or seed to finish
+WRITE_LOCK_TIMEOUT = 300
+
+# Ensure data directory exists
+os.makedirs(DATA_DIR, exist_ok=True)
+
+
+def active_db_path() -> str:
+    """Database file currently published (data/saniradar.db until the scheduler publishes one)."""
+    try:
+        with open(POINTER_FILE) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        name = ""
+    return os.path.join(DATA_DIR, name or DEFAULT_DB)
+
+
+def sqlite_url(path: str) -> str:
+    return f"sqlite:///{path}"
+
+
+def _on_connect(engine, pragmas):
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return engine
+
+
+def make_engine(path: str):
+    """
+    The single writer: schema upgrades, seed and ingest. One connection, so writes are
+    serialized in the pool instead of failing with "database is locked".
+    """
+    engine = create_engine(
+        sqlite_url(path), connect_args={"check_same_thread": False},
+        poolclass=QueuePool, pool_size=1, max_overflow=0,
+    )
+    return _on_connect(engine, WRITE_PRAGMAS)
+
+
+@contextmanager
+def write_lock(engine, timeout: float = WRITE_LOCK_TIMEOUT) -> Iterator[Connection]:
+    """
+    A writer connection inside BEGIN IMMEDIATE: the write lock is taken before anything is
+    read, so check-then-write steps (schema upgrade, seed) run one process at a time and
+    each sees what the previous one committed. Commits on exit, rolls back on error.
+    """
+    deadline = time.monotonic() + timeout
+    with engine.connect() as conn:
+        while True:
+            try:
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                break
+            except OperationalError as e:
+                # busy_timeout already waited; several uvicorn workers may queue here on first boot
+                conn.rollback()
+                if "locked" not in str(e) or time.monotonic() > deadline:
+                    raise
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+
+def make_read_engine(path: str, pool_size: int = READ_POOL_SIZE):
+    """
+    Read-only connections for the API, one per worker thread. Opened with mode=ro, so a
+    reader can never take the write lock; with WAL they never wait for the writer either.
+    """
+    engine = create_engine(
+        f"sqlite:///file:{path.replace(os.sep, '/')}?mode=ro&uri=true", connect_args={"check_same_thread": False},
+        poolclass=QueuePool, pool_size=pool_size, max_overflow=0, pool_timeout=30,
+    )
+    return _on_connect(engine, READ_PRAGMAS)
+
+
+def publish_db(path: str, retries: int = 5) -> None:
+    """Point readers at `path` (a file inside DATA_DIR) with an atomic replace of the pointer."""
+    tmp = f"{POINTER_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(os.path.basename(path))
+    for attempt in range(retries):
+        try:
+            os.replace(tmp, POINTER_FILE)
+            return
+        except PermissionError:
+            # Windows refuses the replace while a reader has the pointer open: it is only for an instant
+            time.sleep(0.05 * (attempt + 1))
+    os.replace(tmp, POINTER_FILE)
@@ -0,0 +1,77 @@
+"""
+Hospital listing read straight from the database cursor, for exports too large to build
+in memory. Produces the same rows as the wait matrix: a hospital's SpecialtyData wait
+when it has one, `hospital.wait + fallback_modifier(specialty)` otherwise.
+"""
+import json
+from typing import Iterator, Optional, Sequence
+
+from sqlalchemy import and_, bindparam, func, select
+
+from backend.models import Hospital, SpecialtyData
+from backend.wait_matrix import HOSPITAL_FIELDS, fallback_modifier
+
+# Rows serialized per chunk written to the response
+STREAM_BATCH = 500
+
+_hospital = Hospital.__table__
+_specialty = SpecialtyData.__table__
+
+
+def parse_fields(fields: Optional[str]) -> Sequence[str]:
+    """`fields=id,lat,lng,wait` as a tuple in HOSPITAL_FIELDS order; ValueError on unknown names."""
+    if not fields:
+        return HOSPITAL_FIELDS
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(HOSPITAL_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return tuple(f for f in HOSPITAL_FIELDS if f in requested)
+
+
+def hospitals_query(fields: Sequence[str], specialty: Optional[str], province_norm: Optional[str],
+                    limit: Optional[int]):
+    """
+    Keyset page (id > :cursor, by id) of hospitals with `wait` for `specialty`. Values
+    are bind parameters, so each shape of query is compiled once and then reused.
+    """
+    wait = _hospital.c.wait
+    source = _hospital
+    if specialty:
+        # The unique (hospital_id, specialty_id) index makes this at most one row per hospital
+        source = _hospital.outerjoin(_specialty, and_(
+            _specialty.c.hospital_id == _hospital.c.id, _specialty.c.specialty_id == bindparam("specialty")
+        ))
+        wait = func.coalesce(_specialty.c.wait, _hospital.c.wait + bindparam("modifier"))
+    columns = [wait.label("wait") if f == "wait" else _hospital.c[f] for f in fields]
+
+    query = select(*columns).select_from(source).where(_hospital.c.id > bindparam("cursor")).order_by(_hospital.c.id)
+    if province_norm:
+        query = query.where(_hospital.c.province_norm == bindparam("province"))
+    if limit:
+        query = query.limit(bindparam("limit"))
+    return query
+
+
+def stream_hospitals(engine, fields: Sequence[str], specialty: Optional[str] = None,
+                     province_norm: Optional[str] = None, cursor: int = 0,
+                     limit: Optional[int] = None) -> Iterator[bytes]:
+    """NDJSON lines, a batch at a time, while the rows are read from the cursor."""
+    specialty = specialty if specialty and specialty != "all" else None
+    params = {"cursor": cursor}
+    if specialty:
+        params.update(specialty=specialty, modifier=fallback_modifier(specialty))
+    if province_norm:
+        params["province"] = province_norm
+    if limit:
+        params["limit"] = limit
+
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(
+            hospitals_query(fields, specialty, province_norm, limit), params
+        )
+        while True:
+            rows = result.fetchmany(STREAM_BATCH)
+            if not rows:
+                break
+            yield "".join(json.dumps(dict(zip(fields, row)), ensure_ascii=False) + "\n" for row in rows).encode("utf-8")
@@ -0,0 +1,261 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select, text
+
+from backend.models import Hospital, SpecialtyData
+from backend.versioning import bump_version
+from backend.wait_matrix import SPECIALTY_IDS
+
+HISTORY_DIR = os.path.join("data", "history")
+
+# Column 0 is the hospital's general wait ("all"), then one column per specialty
+COLUMNS = ("all", *SPECIALTY_IDS)
+# int16 keeps a period of 10k centres × 43 columns under 1 MB; -1 marks "no data"
+MISSING = -1
+PERIOD_RE = re.compile(r"^\d{4}-\d{2}$")
+# SpecialtyData rows fetched per round trip while building a snapshot
+SNAPSHOT_BATCH = 50_000
+
+
+def current_period() -> str:
+    return datetime.now().strftime("%Y-%m")
+
+
+def previous_period(period: str) -> str:
+    year, month = map(int, period.split("-"))
+    return f"{year - 1}-12" if month == 1 else f"{year}-{month - 1:02d}"
+
+
+class HistoryStore:
+    """
+    Append-only columnar store of monthly wait snapshots.
+
+    Each period is three files under `root`: `<period>.ids.npy` (hospital ids, sorted),
+    `<period>.waits.npy` (int16, hospitals × columns) and `<period>.json` (column names).
+    Files are written once through a rename, never modified in place, and read back as
+    memory maps, so a range query only touches the pages it needs.
+    """
+
+    def __init__(self, root: str = HISTORY_DIR):
+        self.root = root
+        self._cache: Dict[str, Tuple[int, np.ndarray, np.ndarray, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, period: str, suffix: str) -> str:
+        return os.path.join(self.root, f"{period}.{suffix}")
+
+    def periods(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name[:-len(".json")] for name in os.listdir(self.root)
+                      if name.endswith(".json") and PERIOD_RE.match(name[:-len(".json")]))
+
+    def append(self, period: str, hospital_ids: np.ndarray, waits: np.ndarray,
+               columns: Tuple[str, ...] = COLUMNS) -> None:
+        """Write the snapshot for `period`. Re-ingesting a period replaces only that period."""
+        if not PERIOD_RE.match(period):
+            raise ValueError(f"Invalid period {period!r}, expected YYYY-MM")
+        order = np.argsort(hospital_ids, kind="stable")
+        ids = np.asarray(hospital_ids, dtype=np.int64)[order]
+        values = np.clip(np.asarray(waits)[order], MISSING, np.iinfo(np.int16).max).astype(np.int16)
+
+        os.makedirs(self.root, exist_ok=True)
+        for suffix, array in (("ids.npy", ids), ("waits.npy", values)):
+            tmp = self._path(period, suffix + ".tmp")
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp, self._path(period, suffix))
+        # The JSON is written last: a period only shows up in periods() once it is complete
+        tmp = self._path(period, "json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"period": period, "columns": list(columns)}, f)
+        os.replace(tmp, self._path(period, "json"))
+
+    def merge(self, period: str, hospital_ids: np.ndarray, waits: np.ndarray) -> None:
+        """
+        Write `period` with the rows of `hospital_ids` replaced (or added); hospitals already
+        in the period and not given keep theirs. Without a previous file it is just append().
+        """
+        if period in self.periods():
+            old_ids, old_waits, columns = self.load(period)
+            keep = ~np.isin(old_ids, hospital_ids)
+            kept = np.full((int(keep.sum()), len(COLUMNS)), MISSING, dtype=np.int16)
+            for col, name in enumerate(COLUMNS):
+                if name in columns:
+                    kept[:, col] = old_waits[keep, columns[name]]
+            hospital_ids = np.concatenate([old_ids[keep], hospital_ids])
+            waits = np.concatenate([kept, waits])
+            # Unmap the old files before they are replaced
+            del old_ids, old_waits
+            with self._lock:
+                self._cache.pop(period, None)
+        self.append(period, hospital_ids, waits)
+
+    def load(self, period: str) -> Tuple[np.ndarray, np.ndarray, Dict[str, int]]:
+        """(hospital ids, waits memmap, column index) for one period."""
+        meta_path = self._path(period, "json")
+        mtime = os.stat(meta_path).st_mtime_ns
+        with self._lock:
+            cached = self._cache.get(period)
+        if cached is not None and cached[0] == mtime:
+            return cached[1:]
+        with open(meta_path) as f:
+            columns = {name: i for i, name in enumerate(json.load(f)["columns"])}
+        ids = np.load(self._path(period, "ids.npy"), mmap_mode="r")
+        waits = np.load(self._path(period, "waits.npy"), mmap_mode="r")
+        with self._lock:
+            self._cache[period] = (mtime, ids, waits, columns)
+        return ids, waits, columns
+
+    def _range(self, start: Optional[str], end: Optional[str]) -> List[str]:
+        return [p for p in self.periods() if (not start or p >= start) and (not end or p <= end)]
+
+    def series(self, hospital_id: int, column: str = "all",
+               start: Optional[str] = None, end: Optional[str] = None) -> Tuple[List[str], np.ndarray]:
+        """Periods in range and the wait of one hospital in each (NaN where missing)."""
+        periods = self._range(start, end)
+        values = np.full(len(periods), np.nan)
+        for i, period in enumerate(periods):
+            ids, waits, columns = self.load(period)
+            col = columns.get(column)
+            row = np.searchsorted(ids, hospital_id)
+            if col is not None and row < len(ids) and ids[row] == hospital_id and waits[row, col] != MISSING:
+                values[i] = waits[row, col]
+        return periods, values
+
+    def cube(self, column: Optional[str] = None, start: Optional[str] = None,
+             end: Optional[str] = None) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Periods in range, the union of hospital ids and a float array aligned on them:
+        periods × hospitals × columns (or periods × hospitals for a single `column`).
+        Missing values are NaN, so trends can be computed over the whole matrix at once.
+        """
+        periods = self._range(start, end)
+        loaded = [self.load(p) for p in periods]
+        all_ids = np.unique(np.concatenate([ids for ids, _, _ in loaded])) if loaded else np.empty(0, np.int64)
+        shape = (len(periods), len(all_ids)) if column else (len(periods), len(all_ids), len(COLUMNS))
+        out = np.full(shape, np.nan)
+        for i, (ids, waits, columns) in enumerate(loaded):
+            rows = np.searchsorted(all_ids, ids)
+            if column:
+                if column not in columns:
+                    continue
+                values = waits[:, columns[column]].astype(float)
+                values[values == MISSING] = np.nan
+                out[i, rows] = values
+            else:
+                cols = [columns.get(name) for name in COLUMNS]
+                present = [j for j, c in enumerate(cols) if c is not None]
+                values = waits[:, [cols[j] for j in present]].astype(float)
+                values[values == MISSING] = np.nan
+                out[i, rows[:, None], np.array(present)[None, :]] = values
+        return periods, all_ids, out
+
+
+def deltas(values: np.ndarray) -> np.ndarray:
+    """Change from the previous period along axis 0 (first period is NaN)."""
+    out = np.full(values.shape, np.nan)
+    out[1:] = np.diff(values, axis=0)
+    return out
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the last `window` periods along axis 0, ignoring missing values."""
+    present = ~np.isnan(values)
+    sums = np.cumsum(np.where(present, values, 0.0), axis=0)
+    counts = np.cumsum(present, axis=0)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def percent_trend(values: np.ndarray) -> np.ndarray:
+    """Percent change between the last two periods, per hospital (NaN if either is missing)."""
+    if values.shape[0] < 2:
+        return np.full(values.shape[1:], np.nan)
+    prev, last = values[-2], values[-1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(prev > 0, np.round(100 * (last - prev) / prev), np.nan)
+
+
+history = HistoryStore()
+
+
+def snapshot_arrays(conn) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (hospital ids, int16 waits hospitals × COLUMNS) straight from the tables. Only observed
+    figures are kept: a specialty without a SpecialtyData row stays MISSING.
+    """
+    hospital = Hospital.__table__
+    rows = conn.execute(select(hospital.c.id, hospital.c.wait).order_by(hospital.c.id)).all()
+    ids = np.array([r[0] for r in rows], dtype=np.int64)
+    waits = np.full((len(ids), len(COLUMNS)), MISSING, dtype=np.int16)
+    waits[:, 0] = np.clip([r[1] for r in rows], MISSING, np.iinfo(np.int16).max)
+
+    column = {name: i for i, name in enumerate(COLUMNS)}
+    specialty = SpecialtyData.__table__
+    result = conn.execution_options(stream_results=True).execute(
+        select(specialty.c.hospital_id, specialty.c.specialty_id, specialty.c.wait)
+    )
+    for batch in result.partitions(SNAPSHOT_BATCH):
+        batch = [r for r in batch if r[1] in column]
+        rows_at = np.searchsorted(ids, [r[0] for r in batch])
+        cols = np.array([column[r[1]] for r in batch], dtype=np.intp)
+        waits[rows_at, cols] = np.clip([r[2] for r in batch], MISSING, np.iinfo(np.int16).max)
+    return ids, waits
+
+
+def record_snapshot(engine, period: Optional[str] = None, hospital_ids: Optional[Iterable[int]] = None,
+                    store: HistoryStore = history) -> str:
+    """
+    Save the current figures as the snapshot for `period` (this month by default). With
+    `hospital_ids`, only those hospitals are written, merged into the period's file: a load
+    of one community's report must not record everyone else's old figures as this month's.
+    """
+    period = period or current_period()
+    with engine.connect() as conn:
+        ids, waits = snapshot_arrays(conn)
+    if hospital_ids is None:
+        store.append(period, ids, waits)
+    else:
+        touched = np.isin(ids, np.fromiter(hospital_ids, dtype=np.int64))
+        store.merge(period, ids[touched], waits[touched])
+    # /api/history responses are cached per dataset version too; no hospital changed
+    with engine.begin() as conn:
+        bump_version(conn, ())
+    return period
+
+
+def append_by_id(period: str, waits: np.ndarray, store: HistoryStore = history) -> None:
+    """
+    Write a period from an int16 array whose row i holds hospital id i (as filled by
+    load_data.collect_last_month); rows with every cell MISSING are left out.
+    """
+    ids = np.flatnonzero((waits != MISSING).any(axis=1))
+    store.append(period, ids, waits[ids])
+
+
+def update_trends(engine, store: HistoryStore = history) -> int:
+    """
+    Recompute Hospital.trend as the percent change of the general wait between the last
+    two periods, for every hospital at once. Returns how many hospitals were updated.
+    """
+    periods, ids, values = store.cube("all")
+    trend = percent_trend(values)
+    known = ~np.isnan(trend)
+    if not known.any():
+        return 0
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE hospital SET trend = :trend WHERE id = :id"),
+            [{"trend": int(t), "id": int(h_id)} for h_id, t in zip(ids[known], trend[known])],
+        )
+        bump_version(conn, ids[known])
+    return int(known.sum())
@@ -1,36 +1,225 @@
-from sqlmodel import Session, create_engine, select
-from main import Hospital, sqlite_url
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert
+from backend.database import active_db_path, make_engine
+from backend.metrics import stage_timer, write_textfile
+from backend.models import Hospital, SpecialtyData, SPECIALTY_ALIASES, normalize_str
+from backend.schema import upgrade_schema
+from backend.versioning import bump_version
+from backend.history import (COLUMNS, MISSING, append_by_id, current_period, history, previous_period,
+                             record_snapshot, update_trends)
+import numpy as np
 import pandas as pd
+import logging
 import os
+import sys
+import time
+from typing import Iterable, Optional
 
-# Ensure the database exists by importing the engine
-engine = create_engine(sqlite_url)
+# Loads from the command line go to the published database; the scheduler passes its staging engine
+engine = make_engine(active_db_path())
 
-def load_hospitals_from_csv(csv_path: str):
+# Rows per chunk: memory stays bounded by this, not by the size of the file
+CHUNK_SIZE = 50_000
+# Keep IN (...) lists under SQLite's bound-parameter limit
+ID_LOOKUP_BATCH = 500
+
+CSV_COLUMNS = {"hospital", "city", "specialty", "wait_days", "last_month_wait", "lat", "lng"}
+
+# Dummy coords for hospitals whose extract has none
+DEFAULT_LAT, DEFAULT_LNG = 40.0, -3.0
+
+HISTORY_COLUMN = {name: i for i, name in enumerate(COLUMNS)}
+
+
+def specialty_ids(names: pd.Series) -> pd.Series:
+    """Map free-text specialty names to SPECIALTIES ids (NaN when unknown), vectorized."""
+    normalized = (
+        names.astype("string")
+        .str.strip()
+        .str.lower()
+        .str.normalize("NFKD")
+        .str.encode("ascii", errors="ignore")
+        .str.decode("ascii")
+    )
+    return normalized.map(SPECIALTY_ALIASES)
+
+
+def prepare_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    chunk = chunk.dropna(subset=["hospital", "wait_days"])
+    chunk = chunk.assign(
+        hospital=chunk["hospital"].astype(str).str.strip(),
+        wait_days=chunk["wait_days"].astype(int),
+    )
+    # Names repeat across provinces (several "Hospital San Juan de Dios"): a centre is name + province.
+    # Same province key the ORM hook stores; few distinct cities, so normalize each once
+    cities = chunk["city"].astype(str)
+    chunk["province_norm"] = cities.map({c: normalize_str(c) for c in cities.unique()})
+    chunk["hospital_key"] = list(zip(chunk["hospital"], chunk["province_norm"]))
+    if "specialty" in chunk:
+        # Only an empty cell is a hospital-level figure; names we cannot map are dropped
+        names = chunk["specialty"].astype("string").str.strip()
+        ids = specialty_ids(names)
+        unknown = names.notna() & (names != "") & ids.isna()
+        if unknown.any():
+            logging.warning(f"{int(unknown.sum())} filas con especialidad desconocida "
+                            f"({', '.join(names[unknown].unique()[:5])})")
+        chunk = chunk[~unknown].assign(specialty_id=ids[~unknown])
+    else:
+        chunk["specialty_id"] = pd.NA
+    if "last_month_wait" in chunk:
+        # Percent change, which is what the frontend shows next to each hospital
+        last = chunk["last_month_wait"].where(chunk["last_month_wait"] > 0)
+        chunk["trend"] = (100 * (chunk["wait_days"] - last) / last).round().fillna(0).astype(int)
+    else:
+        chunk["trend"] = 0
+    return chunk
+
+
+def upsert_hospitals(conn, chunk: pd.DataFrame, hospital_ids: dict):
+    """
+    Insert hospitals not seen yet in this load and update existing ones, keyed by name and
+    province (`hospital_key`).
+
+    Rows with an empty specialty are hospital-level figures and overwrite wait/trend;
+    specialty rows only provide the initial wait of a hospital that did not exist.
+    """
+    has_coords = "lat" in chunk and "lng" in chunk
+    general = chunk["specialty_id"].isna()
+    for rows, update_wait in ((chunk[~general], False), (chunk[general], True)):
+        if not update_wait:
+            rows = rows[rows["hospital_key"].map(hospital_ids).isna()]
+        rows = rows.drop_duplicates(["hospital", "province_norm"], keep="last")
+        if rows.empty:
+            continue
+
+        records = pd.DataFrame({
+            "name_es": rows["hospital"],
+            "name_en": rows["hospital"],  # Fallback
+            "city": rows["city"].astype(str),
+            "province_norm": rows["province_norm"],
+            "lat": rows["lat"].fillna(DEFAULT_LAT) if has_coords else DEFAULT_LAT,
+            "lng": rows["lng"].fillna(DEFAULT_LNG) if has_coords else DEFAULT_LNG,
+            "wait": rows["wait_days"],
+            "trend": rows["trend"],
+        }).to_dict("records")
+
+        stmt = insert(Hospital.__table__)
+        updates = {"city": stmt.excluded.city}
+        if has_coords:
+            updates.update(lat=stmt.excluded.lat, lng=stmt.excluded.lng)
+        if update_wait:
+            updates.update(wait=stmt.excluded.wait, trend=stmt.excluded.trend)
+        conn.execute(stmt.on_conflict_do_update(index_elements=["name_es", "province_norm"], set_=updates), records)
+
+    missing = {key for key in chunk["hospital_key"].unique() if key not in hospital_ids}
+    names = sorted({name for name, _ in missing})
+    table = Hospital.__table__
+    for i in range(0, len(names), ID_LOOKUP_BATCH):
+        batch = names[i:i + ID_LOOKUP_BATCH]
+        query = select(table.c.id, table.c.name_es, table.c.province_norm).where(table.c.name_es.in_(batch))
+        for hospital_id, name, province_norm in conn.execute(query):
+            # Same-named centres in other provinces are not part of this load
+            if (name, province_norm) in missing:
+                hospital_ids[(name, province_norm)] = hospital_id
+
+
+def upsert_specialties(conn, chunk: pd.DataFrame, hospital_ids: dict):
+    rows = chunk[chunk["specialty_id"].notna()].drop_duplicates(["hospital", "province_norm", "specialty_id"], keep="last")
+    if rows.empty:
+        return
+    records = pd.DataFrame({
+        "hospital_id": rows["hospital_key"].map(hospital_ids),
+        "specialty_id": rows["specialty_id"].astype(str),
+        "wait": rows["wait_days"],
+    }).to_dict("records")
+
+    stmt = insert(SpecialtyData.__table__)
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["hospital_id", "specialty_id"], set_={"wait": stmt.excluded.wait}
+        ),
+        records,
+    )
+
+
+def collect_last_month(chunk: pd.DataFrame, hospital_ids: dict, previous: np.ndarray) -> np.ndarray:
+    """
+    Write the chunk's last_month_wait into `previous` (int16, row = hospital id, one column
+    per history column) and return it, reallocated with room to spare when an id falls outside.
+    """
+    if "last_month_wait" not in chunk:
+        return previous
+    rows = chunk[chunk["last_month_wait"].notna()]
+    if rows.empty:
+        return previous
+    hospital = rows["hospital_key"].map(hospital_ids).to_numpy(dtype=np.int64)
+    column = rows["specialty_id"].fillna("all").map(HISTORY_COLUMN).to_numpy(dtype=np.int64)
+    if hospital.max() >= len(previous):
+        grown = np.full((max(hospital.max() + 1, 2 * len(previous)), len(COLUMNS)), MISSING, dtype=np.int16)
+        grown[:len(previous)] = previous
+        previous = grown
+    values = rows["last_month_wait"].to_numpy(dtype=np.int64)
+    previous[hospital, column] = np.clip(values, MISSING, np.iinfo(np.int16).max)
+    return previous
+
+
+def load_frames(frames: Iterable[pd.DataFrame], engine=engine, period: Optional[str] = None) -> int:
+    """
+    Upsert a stream of extract-shaped DataFrames (hospital, city, specialty, wait_days,
+    optional last_month_wait/lat/lng) into Hospital and SpecialtyData.
+
+    Each frame is upserted with executemany statements inside its own transaction, so
+    re-running a load updates rows instead of duplicating them. Afterwards the result is
+    appended to the history as `period` (this month by default) and trends are recomputed.
+    """
+    upgrade_schema(engine)
+    hospital_ids = {}  # (name_es, province_norm) -> id; grows with hospitals, not with rows
+    previous = np.full((0, len(COLUMNS)), MISSING, dtype=np.int16)  # last_month_wait per hospital id × column
+    total = 0
+    start = time.perf_counter()
+
+    with stage_timer("ingest"):
+        for chunk in frames:
+            chunk = prepare_chunk(chunk)
+            with engine.begin() as conn:
+                upsert_hospitals(conn, chunk, hospital_ids)
+                upsert_specialties(conn, chunk, hospital_ids)
+                # Running API processes pick the new data up from the version bump (and the ids it logs)
+                bump_version(conn, chunk["hospital_key"].map(hospital_ids).unique())
+            previous = collect_last_month(chunk, hospital_ids, previous)
+            total += len(chunk)
+            elapsed = time.perf_counter() - start
+            print(f"  {total} rows ({total / elapsed:,.0f} rows/s)")
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed else 0
+    print(f"Loaded {total} rows ({len(hospital_ids)} hospitals) in {elapsed:.2f}s ({rate:,.0f} rows/s).")
+
+    period = period or current_period()
+    with stage_timer("history"):
+        # Only the hospitals in this load: the others were not observed this period
+        record_snapshot(engine, period, hospital_ids.values())
+        # The extract also carries last month's figures: use them when that period was never ingested
+        if (previous != MISSING).any() and previous_period(period) not in history.periods():
+            append_by_id(previous_period(period), previous)
+        updated = update_trends(engine)
+    print(f"History: snapshot {period} saved, trend updated for {updated} hospitals.")
+    return total
+
+
+def load_hospitals_from_csv(csv_path: str, chunksize: int = CHUNK_SIZE, engine=engine,
+                            period: Optional[str] = None) -> int:
+    """Stream an SNS extract CSV into the database, `chunksize` rows at a time."""
     if not os.path.exists(csv_path):
         print(f"Error: {csv_path} not found.")
-        return
+        return 0
+    reader = pd.read_csv(csv_path, chunksize=chunksize, usecols=lambda c: c in CSV_COLUMNS)
+    return load_frames(reader, engine, period)
 
-    df = pd.read_csv(csv_path)
-    # Map CSV columns to SQL Model (Assuming columns match or are mapped)
-    # For now, we simulate loading more data
-    
-    with Session(engine) as session:
-        for index, row in df.iterrows():
-            # Basic validation/mapping
-            hosp = Hospital(
-                name_es=row['hospital'],
-                name_en=row['hospital'], # Fallback
-                city=row['city'],
-                lat=40.0, # Dummy coords for now
-                lng=-3.0,
-                wait=row['wait_days'],
-                trend=0
-            )
-            session.add(hosp)
-        session.commit()
-    print(f"Loaded {len(df)} hospitals into database.")
 
 if __name__ == "__main__":
-    # Path to the data generated by the scraper
-    load_hospitals_from_csv("data/waiting_times_latest.csv")
+    # Path to the data generated by the scraper (optionally followed by the period, YYYY-MM)
+    args = sys.argv[1:]
+    load_hospitals_from_csv(args[0] if args else "data/waiting_times_latest.csv",
+                            period=args[1] if len(args) > 1 else None)
+    write_textfile("load_data")
@@ -1,48 +1,45 @@
-from fastapi import FastAPI, Depends, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from sqlmodel import Field, SQLModel, create_engine, Session, select
+from fastapi.responses import Response, StreamingResponse
 from typing import List, Optional
-import os
-import threading
+import base64
+import ipaddress
+import logging
+import math
+import numpy as np
 import time
-from backend.sync_service import check_for_new_reports
-
-# --- Models ---
-class Hospital(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    name_es: str
-    name_en: str
-    city: str
-    lat: float
-    lng: float
-    wait: int
-    trend: int
-
-class SpecialtyData(SQLModel, table=True):
-    id: Optional[int] = Field(default=None, primary_key=True)
-    hospital_id: int = Field(foreign_key="hospital.id")
-    specialty_id: str
-    wait: int
+from backend.database import active_db_path, make_engine, make_read_engine
+from backend.export import parse_fields, stream_hospitals
+from backend.history import deltas, history, rolling_mean
+from backend import metrics
+from backend.metrics import MetricsMiddleware, ProfiledRoute
+from backend.models import Hospital, SPECIALTIES, normalize_str
+from backend.rankings import GENERAL
+from backend.response_cache import cached_json
+from backend.schema import upgrade_schema
+from backend.seed import seed_database
+from backend.wait_matrix import HOSPITAL_FIELDS, SPECIALTY_IDS, SPECIALTY_INDEX, WaitMatrix, get_wait_matrix, store as wait_matrix_store, watch_database
+
+# Measured from import, so the startup log shows the whole time to first request
+STARTED_AT = time.perf_counter()
 
 # --- Database ---
-sqlite_file_name = "data/saniradar.db"
-sqlite_url = f"sqlite:///{sqlite_file_name}"
+# The file published by the scheduler; the wait matrix store follows later publications
+sqlite_file_name = active_db_path()
+# Writer (startup schema upgrade and seed) and the read-only pool requests use
+engine = make_engine(sqlite_file_name)
+read_engine = make_read_engine(sqlite_file_name)
 
-# Ensure data directory exists
-os.makedirs("data", exist_ok=True)
-
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+# The in-memory wait matrix follows the version bumps of every process that writes the data
+watch_database(sqlite_file_name, read_engine)
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
-
-def get_session():
-    with Session(engine) as session:
-        yield session
+    upgrade_schema(engine)
 
 # --- App ---
 app = FastAPI(title="SaniRadar API", version="0.2.2")
+# Every route below can be sampled by the slow-request profiler (see backend/metrics.py)
+app.router.route_class = ProfiledRoute
 
 PROVINCES = sorted([
     "Álava", "Albacete", "Alicante", "Almería", "Asturias", "Ávila", "Badajoz", "Barcelona", "Burgos", "Cáceres", 
@@ -53,206 +50,24 @@ PROVINCES = sorted([
     "Valladolid", "Vizcaya", "Zamora", "Zaragoza", "Ceuta", "Melilla"
 ])
 
-SPECIALTIES = [
-    {"id": "allergy", "key": "spec-allergy"},
-    {"id": "pathology", "key": "spec-pathology"},
-    {"id": "anesthesia", "key": "spec-anesthesia"},
-    {"id": "angiology", "key": "spec-angiology"},
-    {"id": "digestive", "key": "spec-digestive"},
-    {"id": "cardio", "key": "spec-cardio"},
-    {"id": "cardiovascular-surgery", "key": "spec-cardiovascular-surgery"},
-    {"id": "general-surgery", "key": "spec-general-surgery"},
-    {"id": "maxillofacial", "key": "spec-maxillofacial"},
-    {"id": "trauma", "key": "spec-trauma"},
-    {"id": "pediatric-surgery", "key": "spec-pediatric-surgery"},
-    {"id": "plastic", "key": "spec-plastic"},
-    {"id": "thoracic", "key": "spec-thoracic"},
-    {"id": "dermo", "key": "spec-dermo"},
-    {"id": "endocrinology", "key": "spec-endocrinology"},
-    {"id": "pharmacology", "key": "spec-pharmacology"},
-    {"id": "geriatrics", "key": "spec-geriatrics"},
-    {"id": "hematology", "key": "spec-hematology"},
-    {"id": "immunology", "key": "spec-immunology"},
-    {"id": "occupational-medicine", "key": "spec-occupational-medicine"},
-    {"id": "family-medicine", "key": "spec-family-medicine"},
-    {"id": "rehab", "key": "spec-rehab"},
-    {"id": "intensive-care", "key": "spec-intensive-care"},
-    {"id": "internal-medicine", "key": "spec-internal-medicine"},
-    {"id": "forensic", "key": "spec-forensic"},
-    {"id": "nuclear-medicine", "key": "spec-nuclear-medicine"},
-    {"id": "preventive", "key": "spec-preventive"},
-    {"id": "nephrology", "key": "spec-nephrology"},
-    {"id": "pneumology", "key": "spec-pneumology"},
-    {"id": "neurosurgery", "key": "spec-neurosurgery"},
-    {"id": "neurophysiology", "key": "spec-neurophysiology"},
-    {"id": "neurology", "key": "spec-neurology"},
-    {"id": "gyn", "key": "spec-gyn"},
-    {"id": "ophthalmology", "key": "spec-ophthalmology"},
-    {"id": "medical-oncology", "key": "spec-medical-oncology"},
-    {"id": "radiation-oncology", "key": "spec-radiation-oncology"},
-    {"id": "ent", "key": "spec-ent"},
-    {"id": "pediatrics", "key": "spec-pediatrics"},
-    {"id": "psychiatry", "key": "spec-psychiatry"},
-    {"id": "radiology", "key": "spec-radiology"},
-    {"id": "rheumatology", "key": "spec-rheumatology"},
-    {"id": "urology", "key": "spec-urology"}
-]
-
 @app.get("/api/specialties")
-def get_specialties():
-    return SPECIALTIES
+def get_specialties(request: Request, matrix: WaitMatrix = Depends(get_wait_matrix)):
+    return cached_json(request, "specialties", None, matrix.version, lambda: SPECIALTIES)
 
 @app.on_event("startup")
 def on_startup():
+    # Schema upgrades and the seed are versioned in DatasetMeta: nothing to do on a normal boot
     create_db_and_tables()
-    # Seed data if empty or incomplete
-    with Session(engine) as session:
-        statement = select(Hospital)
-        results = session.exec(statement).all()
-        # Si hay pocos hospitales (menos de 70), limpiamos y re-poblamos para asegurar cobertura total
-        if len(results) < 70:
-            # Eliminar antiguos para evitar duplicados en el re-seed
-            for h in results:
-                session.delete(h)
-            # También limpiar especialidades viejas
-            old_specialties = session.exec(select(SpecialtyData)).all()
-            for s in old_specialties:
-                session.delete(s)
-            session.commit()
-            
-            seed_data = [
-                # Andalucía
-                Hospital(name_es="Hosp. Virgen del Rocío", name_en="Virgen del Rocio Hospital", city="Sevilla", lat=37.3592, lng=-5.9806, wait=105, trend=4),
-                Hospital(name_es="Hosp. Carlos Haya", name_en="Carlos Haya Hospital", city="Málaga", lat=36.7213, lng=-4.4214, wait=120, trend=10),
-                Hospital(name_es="Hosp. Virgen de las Nieves", name_en="Virgen de las Nieves Hospital", city="Granada", lat=37.1895, lng=-3.6095, wait=110, trend=2),
-                Hospital(name_es="Hosp. Puerta del Mar", name_en="Puerta del Mar Hospital", city="Cádiz", lat=36.5111, lng=-6.2736, wait=95, trend=-1),
-                Hospital(name_es="Hosp. Reina Sofía", name_en="Reina Sofia Hospital", city="Córdoba", lat=37.8687, lng=-4.7936, wait=85, trend=3),
-                Hospital(name_es="Hosp. Juan Ramón Jiménez", name_en="Juan Ramon Jimenez Hospital", city="Huelva", lat=37.2825, lng=-6.9536, wait=102, trend=5),
-                Hospital(name_es="Hosp. Torrecárdenas", name_en="Torrecardenas Hospital", city="Almería", lat=36.8587, lng=-2.4392, wait=115, trend=6),
-                Hospital(name_es="Hosp. Ciudad de Jaén", name_en="Jaen Hospital", city="Jaén", lat=37.7656, lng=-3.7744, wait=98, trend=4),
-
-                # Aragón
-                Hospital(name_es="Hosp. Miguel Servet", name_en="Miguel Servet Hospital", city="Zaragoza", lat=41.6341, lng=-0.8931, wait=88, trend=2),
-                Hospital(name_es="Hosp. San Jorge", name_en="San Jorge Hospital", city="Huesca", lat=42.1317, lng=-0.4181, wait=75, trend=-2),
-                Hospital(name_es="Hosp. Obispo Polanco", name_en="Obispo Polanco Hospital", city="Teruel", lat=40.3425, lng=-1.1067, wait=70, trend=-1),
-
-                # Asturias
-                Hospital(name_es="Hosp. Universitario Central de Asturias", name_en="Asturias Central Hospital", city="Asturias", lat=43.3761, lng=-5.8428, wait=85, trend=-3),
-
-                # Baleares
-                Hospital(name_es="Hosp. Son Espases", name_en="Son Espases Hospital", city="Islas Baleares", lat=39.6083, lng=2.6394, wait=92, trend=4),
-                Hospital(name_es="Hosp. Can Misses", name_en="Can Misses Hospital", city="Ibiza", lat=38.9189, lng=1.4239, wait=110, trend=5), # Ibiza
-                Hospital(name_es="Hosp. Mateu Orfila", name_en="Mateu Orfila Hospital", city="Menorca", lat=39.8864, lng=4.2514, wait=85, trend=2), # Menorca
-                Hospital(name_es="Hosp. de Formentera", name_en="Formentera Hospital", city="Formentera", lat=38.7064, lng=1.4425, wait=70, trend=-1),
-
-                # Canarias
-                Hospital(name_es="Hosp. Dr. Negrín", name_en="Dr. Negrin Hospital", city="Las Palmas", lat=28.1256, lng=-15.4475, wait=140, trend=8),
-                Hospital(name_es="Hosp. Univ. de Canarias", name_en="Canary Islands Univ. Hospital", city="Santa Cruz de Tenerife", lat=28.4552, lng=-16.2847, wait=135, trend=10),
-                Hospital(name_es="Hosp. Dr. José Molina Orosa", name_en="Dr. Jose Molina Orosa Hospital", city="Lanzarote", lat=28.9722, lng=-13.5656, wait=120, trend=4), # Lanzarote
-                Hospital(name_es="Hosp. de Fuerteventura", name_en="Fuerteventura Hospital", city="Fuerteventura", lat=28.5039, lng=-13.8686, wait=115, trend=3),
-                Hospital(name_es="Hosp. General de La Palma", name_en="La Palma General Hospital", city="La Palma", lat=28.6608, lng=-17.7781, wait=105, trend=2),
-                Hospital(name_es="Hosp. Nuestra Señora de los Reyes", name_en="Our Lady of the Kings Hospital", city="El Hierro", lat=27.8103, lng=-17.9158, wait=65, trend=-2), # El Hierro
-                Hospital(name_es="Hosp. Nuestra Señora de Guadalupe", name_en="Our Lady of Guadalupe Hospital", city="La Gomera", lat=28.0933, lng=-17.1194, wait=75, trend=1), # La Gomera
-
-                # Cantabria
-                Hospital(name_es="Hosp. Marqués de Valdecilla", name_en="Valdecilla Hospital", city="Cantabria", lat=43.4561, lng=-3.8292, wait=80, trend=-2),
-
-                # Castilla - La Mancha
-                Hospital(name_es="Hosp. Universitario de Toledo", name_en="Toledo University Hospital", city="Toledo", lat=39.8722, lng=-3.9961, wait=130, trend=12),
-                Hospital(name_es="Hosp. Universitario de Albacete", name_en="Albacete University Hospital", city="Albacete", lat=38.9839, lng=-1.8544, wait=90, trend=3),
-                Hospital(name_es="Hosp. General de Ciudad Real", name_en="Ciudad Real General Hospital", city="Ciudad Real", lat=38.9814, lng=-3.9239, wait=105, trend=5),
-                Hospital(name_es="Hosp. Univ. de Guadalajara", name_en="Guadalajara Univ. Hospital", city="Guadalajara", lat=40.6303, lng=-3.1592, wait=112, trend=7),
-                Hospital(name_es="Hosp. Virgen de la Luz", name_en="Virgen de la Luz Hospital", city="Cuenca", lat=40.0767, lng=-2.1408, wait=88, trend=2),
-
-                # Castilla y León
-                Hospital(name_es="Hosp. Universitario Burgos", name_en="Burgos University Hospital", city="Burgos", lat=42.3439, lng=-3.6969, wait=12, trend=-2),
-                Hospital(name_es="Hosp. Clínico de Valladolid", name_en="Valladolid Clinical Hospital", city="Valladolid", lat=41.6606, lng=-4.7194, wait=115, trend=9),
-                Hospital(name_es="Hosp. Univ. de Salamanca", name_en="Salamanca Univ. Hospital", city="Salamanca", lat=40.9639, lng=-5.6739, wait=95, trend=4),
-                Hospital(name_es="Hosp. Univ. de León", name_en="Leon Univ. Hospital", city="León", lat=42.6131, lng=-5.5714, wait=108, trend=6),
-                Hospital(name_es="Hosp. de Segovia", name_en="Segovia Hospital", city="Segovia", lat=40.9392, lng=-4.1136, wait=75, trend=-1),
-                Hospital(name_es="Hosp. Univ. de Palencia", name_en="Palencia Univ. Hospital", city="Palencia", lat=42.0125, lng=-4.5264, wait=82, trend=2),
-                Hospital(name_es="Hosp. de Soria", name_en="Soria Hospital", city="Soria", lat=41.7661, lng=-2.4789, wait=65, trend=-2),
-                Hospital(name_es="Hosp. de Zamora", name_en="Zamora Hospital", city="Zamora", lat=41.5036, lng=-5.7486, wait=78, trend=1),
-                Hospital(name_es="Hosp. Univ. de Ávila", name_en="Avila Univ. Hospital", city="Ávila", lat=40.6552, lng=-4.6864, wait=85, trend=3),
-
-                # Cataluña
-                Hospital(name_es="Clínic Barcelona", name_en="Clinic Hospital Barcelona", city="Barcelona", lat=41.3894, lng=2.1528, wait=68, trend=5),
-                Hospital(name_es="Vall d'Hebron", name_en="Vall d'Hebron Hospital", city="Barcelona", lat=41.4276, lng=2.1432, wait=75, trend=-3),
-                Hospital(name_es="Hosp. Josep Trueta", name_en="Josep Trueta Hospital", city="Girona", lat=41.9961, lng=2.8252, wait=110, trend=6),
-                Hospital(name_es="Hosp. Arnau de Vilanova", name_en="Arnau de Vilanova Hospital", city="Lleida", lat=41.6264, lng=0.6083, wait=105, trend=4),
-                Hospital(name_es="Hosp. Joan XXIII", name_en="Joan XXIII Hospital", city="Tarragona", lat=41.1219, lng=1.2389, wait=98, trend=3),
-
-                # Extremadura
-                Hospital(name_es="Hosp. de Badajoz", name_en="Badajoz Hospital", city="Badajoz", lat=38.8789, lng=-6.9786, wait=120, trend=9),
-                Hospital(name_es="Hosp. San Pedro de Alcántara", name_en="San Pedro de Alcantara Hospital", city="Cáceres", lat=39.4792, lng=-6.3769, wait=115, trend=7),
-
-                # Galicia
-                Hospital(name_es="Hosp. Clínico de Santiago", name_en="Santiago Clinical Hospital", city="A Coruña", lat=42.8711, lng=-8.5636, wait=85, trend=-2),
-                Hospital(name_es="Hosp. Álvaro Cunqueiro", name_en="Alvaro Cunqueiro Hospital", city="Pontevedra", lat=42.1969, lng=-8.7417, wait=112, trend=5),
-                Hospital(name_es="Hosp. Lucus Augusti", name_en="Lucus Augusti Hospital", city="Lugo", lat=43.0131, lng=-7.5347, wait=78, trend=-3),
-                Hospital(name_es="Hosp. Univ. de Ourense", name_en="Ourense Univ. Hospital", city="Ourense", lat=42.3422, lng=-7.8547, wait=92, trend=2),
-
-                # Madrid
-                Hospital(name_es="Hosp. La Paz", name_en="La Paz Hospital", city="Madrid", lat=40.4819, lng=-3.6872, wait=145, trend=15),
-                Hospital(name_es="Hosp. Ramón y Cajal", name_en="Ramon y Cajal Hospital", city="Madrid", lat=40.4878, lng=-3.6917, wait=110, trend=8),
-                Hospital(name_es="Hosp. 12 de Octubre", name_en="12 de Octubre Hospital", city="Madrid", lat=40.3775, lng=-3.6975, wait=125, trend=10),
-                Hospital(name_es="Hosp. Clínico San Carlos", name_en="San Carlos Clinical Hospital", city="Madrid", lat=40.4406, lng=-3.7225, wait=105, trend=4),
-
-                # Murcia
-                Hospital(name_es="Hosp. Virgen de la Arrixaca", name_en="Virgen de la Arrixaca Hospital", city="Murcia", lat=37.9431, lng=-1.1347, wait=118, trend=7),
-
-                # Navarra
-                Hospital(name_es="Hosp. Univ. de Navarra", name_en="Navarra Univ. Hospital", city="Navarra", lat=42.8083, lng=-1.6631, wait=72, trend=-4),
-
-                # País Vasco
-                Hospital(name_es="Hosp. Universitario de Álavo", name_en="U. Hospital of Alava", city="Álava", lat=42.8467, lng=-2.6717, wait=45, trend=-5),
-                Hospital(name_es="Hosp. de Basurto", name_en="Basurto Hospital", city="Vizcaya", lat=43.2618, lng=-2.9494, wait=52, trend=-1),
-                Hospital(name_es="Hosp. Donostia", name_en="Donostia Hospital", city="Guipúzcoa", lat=43.3083, lng=-1.9744, wait=68, trend=2),
-
-                # La Rioja
-                Hospital(name_es="Hosp. San Pedro", name_en="San Pedro Hospital", city="La Rioja", lat=42.4592, lng=-2.4286, wait=60, trend=-3),
-
-                # Comunidad Valenciana
-                Hospital(name_es="Hosp. La Fe", name_en="La Fe Hospital", city="Valencia", lat=39.4449, lng=-0.3754, wait=92, trend=-1),
-                Hospital(name_es="Hosp. General de Alicante", name_en="Alicante General Hospital", city="Alicante", lat=38.3562, lng=-0.4908, wait=125, trend=11),
-                Hospital(name_es="Hosp. General de Castellón", name_en="Castellón General Hospital", city="Castellón", lat=39.9961, lng=-0.0436, wait=110, trend=6),
-
-                # Ceuta y Melilla
-                Hospital(name_es="Hosp. Univ. de Ceuta", name_en="Ceuta Univ. Hospital", city="Ceuta", lat=35.8883, lng=-5.3164, wait=55, trend=-2),
-                Hospital(name_es="Hospital Comarcal de Melilla", name_en="Melilla Regional Hospital", city="Melilla", lat=35.2919, lng=-2.9411, wait=65, trend=1)
-            ]
-            session.add_all(seed_data)
-            session.commit()
-            
-            # Seed specific specialty data (Real data from research)
-            hospitals = {h.name_es: h.id for h in session.exec(select(Hospital)).all()}
-            
-            specialty_seed = [
-                # Ibiza - Can Misses
-                SpecialtyData(hospital_id=hospitals["Hosp. Can Misses"], specialty_id="trauma", wait=145),
-                SpecialtyData(hospital_id=hospitals["Hosp. Can Misses"], specialty_id="digestive", wait=40),
-                SpecialtyData(hospital_id=hospitals["Hosp. Can Misses"], specialty_id="dermo", wait=30),
-                SpecialtyData(hospital_id=hospitals["Hosp. Can Misses"], specialty_id="urology", wait=15),
-                
-                # Lanzarote - Molina Orosa
-                SpecialtyData(hospital_id=hospitals["Hosp. Dr. José Molina Orosa"], specialty_id="trauma", wait=74),
-                SpecialtyData(hospital_id=hospitals["Hosp. Dr. José Molina Orosa"], specialty_id="urology", wait=25),
-                SpecialtyData(hospital_id=hospitals["Hosp. Dr. José Molina Orosa"], specialty_id="ophthalmology", wait=90),
-                SpecialtyData(hospital_id=hospitals["Hosp. Dr. José Molina Orosa"], specialty_id="gyn", wait=20),
-            ]
-            session.add_all(specialty_seed)
-            session.commit()
-
-    # Iniciar programador de actualizaciones automáticas (Cada 30 días)
-    def run_periodic_sync():
-        while True:
-            check_for_new_reports()
-            # Dormir 30 días (30 * 24 * 60 * 60 segundos)
-            time.sleep(2592000)
-
-    thread = threading.Thread(target=run_periodic_sync, daemon=True)
-    thread.start()
+    seed_database(engine)
 
+    # Build the wait matrix once; later versions are patched in or rebuilt by wait_matrix_store.current()
+    wait_matrix_store.rebuild(read_engine)
+    metrics.STARTUP_SECONDS.set(time.perf_counter() - STARTED_AT)
+    logging.info(f"Arranque completado en {(time.perf_counter() - STARTED_AT) * 1000:.0f} ms "
+                 f"({len(wait_matrix_store.get())} hospitales)")
+    # La sincronización con el portal del SNS corre aparte: python -m backend.scheduler
+
+app.add_middleware(MetricsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -265,105 +80,319 @@ app.add_middleware(
 def read_root():
     return {"message": "Welcome to SaniRadar API (v0.2.2 - Real Specialty Data)"}
 
-def normalize_str(s: str) -> str:
-    """Simple normalization for accents and case."""
-    import unicodedata
-    return "".join(c for c in unicodedata.normalize('NFD', s.lower()) if unicodedata.category(c) != 'Mn')
-
 @app.get("/api/provinces")
-def get_provinces():
-    return PROVINCES
+def get_provinces(request: Request, matrix: WaitMatrix = Depends(get_wait_matrix)):
+    return cached_json(request, "provinces", None, matrix.version, lambda: PROVINCES)
+
+# Largest page a client can ask for with `limit`
+MAX_PAGE_SIZE = 5000
 
 @app.get("/api/hospitals", response_model=List[Hospital])
 def get_hospitals(
+    request: Request,
     specialty: Optional[str] = None, 
     province: Optional[str] = None,
-    session: Session = Depends(get_session)
+    fields: Optional[str] = None,
+    cursor: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    matrix: WaitMatrix = Depends(get_wait_matrix)
 ):
-    statement = select(Hospital)
-    results = session.exec(statement).all()
-    
-    # Filtering in Python for maximum flexibility with accents/normalization
-    if province and province != "all":
-        norm_prov = normalize_str(province)
-        results = [h for h in results if normalize_str(h.city) == norm_prov]
-    
-    # Use real specialty data if available
-    if specialty and specialty != "all":
-        for h in results:
-            spec_data_stmt = select(SpecialtyData).where(
-                SpecialtyData.hospital_id == h.id,
-                SpecialtyData.specialty_id == specialty
-            )
-            spec_data = session.exec(spec_data_stmt).first()
-            
-            if spec_data:
-                h.wait = spec_data.wait
-            else:
-                # Deterministic simulation fallback
-                modifier = len(specialty) % 7
-                h.wait = h.wait + modifier
-            
-    return results
-            
+    """
+    Hospitals with the wait for `specialty`, optionally in one province.
+
+    `fields` projects the rows (e.g. `id,lat,lng,wait` for the map). `limit` pages them by
+    id: pass the last id received as `cursor`; X-Next-Cursor and Link carry the next one.
+    `format=ndjson` streams one JSON object per line straight from the database cursor,
+    for exports that shouldn't be built in memory. Without these, the response is unchanged.
+    """
+    try:
+        projection = parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    province_norm = normalize_str(province) if province and province != "all" else None
+
+    if format == "ndjson":
+        return StreamingResponse(
+            stream_hospitals(wait_matrix_store.engine, projection, specialty, province_norm, cursor, limit),
+            media_type="application/x-ndjson", headers={"X-Dataset-Version": str(matrix.version)},
+        )
+
+    # Accent/case-insensitive match through the precomputed province index
+    rows = matrix.province_rows(province_norm) if province_norm else np.arange(len(matrix))
+    # Rows are in id order, so the keyset cursor is a binary search
+    if cursor:
+        rows = rows[np.searchsorted(matrix.ids[rows], cursor, side="right"):]
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = int(matrix.ids[rows[-1]])
+
+    def build():
+        # Real specialty data (or the deterministic fallback) is already in the matrix column
+        hospitals = matrix.hospital_rows(rows.tolist(), specialty)
+        if projection != HOSPITAL_FIELDS:
+            hospitals = [{field: h[field] for field in projection} for h in hospitals]
+        return hospitals
+
+    response = cached_json(request, "hospitals", (specialty, province, projection, cursor, limit), matrix.version, build)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+        response.headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return response
+
+@app.get("/api/hospitals/nearby")
+def get_nearby_hospitals(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(50, gt=0, le=1000),
+    k: int = Query(10, ge=1, le=100),
+    specialty: Optional[str] = None,
+    matrix: WaitMatrix = Depends(get_wait_matrix)
+):
+    """The `k` hospitals with the shortest (specialty-adjusted) wait within `radius_km`."""
+    rows, distance = matrix.nearby(lat, lng, radius_km, k, specialty)
+    results = matrix.hospital_rows(rows, specialty)
+    for h, d in zip(results, distance):
+        h["distance_km"] = round(float(d), 2)
     return results
 
+@app.get("/api/clusters")
+def get_clusters(
+    bbox: str = Query(..., description="west,south,east,north"),
+    zoom: int = Query(..., ge=0, le=22),
+    specialty: Optional[str] = None,
+    province: Optional[str] = None,
+    matrix: WaitMatrix = Depends(get_wait_matrix)
+):
+    """
+    Map markers for a viewport: clusters with count, centroid and min/avg/max wait, or
+    single hospitals once the zoom is high enough (or a cluster holds just one).
+    """
+    try:
+        west, south, east, north = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=422, detail="bbox must be west,south,east,north")
+
+    waits = matrix.column(specialty) if specialty and specialty != "all" else matrix.base_wait
+    mask = None
+    if province and province != "all":
+        mask = np.zeros(len(matrix), dtype=bool)
+        mask[matrix.province_rows(normalize_str(province))] = True
+
+    clusters = matrix.clusters.query((west, south, east, north), zoom, waits, mask)
+    for cluster in clusters:
+        row = cluster.pop("row", None)
+        if row is not None:
+            h = matrix.hospitals[row]
+            cluster.update(id=h["id"], name_es=h["name_es"], name_en=h["name_en"], city=h["city"],
+                           wait=cluster["min"], trend=h["trend"])
+    return {"zoom": zoom, "clusters": clusters}
+
 @app.get("/api/stats")
-def get_stats(specialty: Optional[str] = None, session: Session = Depends(get_session)):
-    hospitals = session.exec(select(Hospital)).all()
-    if not hospitals:
+def get_stats(request: Request, specialty: Optional[str] = None, matrix: WaitMatrix = Depends(get_wait_matrix)):
+    return cached_json(request, "stats", specialty, matrix.version, lambda: build_stats(matrix, specialty))
+
+def build_stats(matrix: WaitMatrix, specialty: Optional[str]) -> dict:
+    stats = matrix.stats
+    if stats.count == 0:
         return {"min_hosp": None, "avg": 0, "max_hosp": None, "min_spec": None, "max_spec": None}
     
     # 1. Base average is always the mean of general hospital wait times
-    avg_wait = sum(h.wait for h in hospitals) / len(hospitals)
+    avg_wait = stats.base_sum / stats.count
     
     if specialty and specialty != "all":
         # Specific specialty mode
-        for h in hospitals:
-            sd = session.exec(select(SpecialtyData).where(SpecialtyData.hospital_id == h.id, SpecialtyData.specialty_id == specialty)).first()
-            h.wait = sd.wait if sd else h.wait + (len(specialty) % 7)
+        col = SPECIALTY_INDEX.get(specialty)
+        if col is not None:
+            min_row = matrix.row_of[int(stats.min_id[col])]
+            max_row = matrix.row_of[int(stats.max_id[col])]
+            spec_avg = stats.spec_mean(col)
+        else:
+            # Not one of SPECIALTIES, so it has no materialized aggregates
+            column = matrix.column(specialty)
+            min_row, max_row = int(column.argmin()), int(column.argmax())
+            spec_avg = float(column.mean())
         
-        min_h = min(hospitals, key=lambda h: h.wait)
-        max_h = max(hospitals, key=lambda h: h.wait)
+        min_h, max_h = matrix.hospital_rows([min_row, max_row], specialty)
         return {
             "min_hosp": min_h, "max_hosp": max_h, "avg": round(avg_wait, 1),
-            "min_spec": specialty, "max_spec": specialty
+            "min_spec": specialty, "max_spec": specialty, "spec_avg": round(spec_avg, 1)
         }
     else:
-        # "All" mode: Absolute cross-product search
-        # We fetch all specialty data once to optimize
-        all_sd = session.exec(select(SpecialtyData)).all()
-        sd_map = {}
-        for sd in all_sd:
-            if sd.hospital_id not in sd_map: sd_map[sd.hospital_id] = {}
-            sd_map[sd.hospital_id][sd.specialty_id] = sd.wait
-            
-        abs_min = None
-        abs_max = None
+        # "All" mode: absolute extremes across every hospital × specialty pair, kept by WaitStats
+        min_wait, min_id, min_col = stats.absolute_min()
+        max_wait, max_id, max_col = stats.absolute_max()
         
-        for h in hospitals:
-            h_sd = sd_map.get(h.id, {})
-            for s in SPECIALTIES:
-                sid = s["id"]
-                val = h_sd.get(sid, h.wait + (len(sid) % 7))
-                
-                record = {"h": h, "w": val, "s": sid}
-                if abs_min is None or val < abs_min["w"]: abs_min = record
-                if abs_max is None or val > abs_max["w"]: abs_max = record
-        
-        # We must clones the hospital objects to avoid modifying the ones in session (though we aren't committing)
-        # and update their 'wait' to the correct record value
-        final_min = abs_min["h"].model_copy()
-        final_min.wait = abs_min["w"]
-        
-        final_max = abs_max["h"].model_copy()
-        final_max.wait = abs_max["w"]
+        final_min = dict(matrix.hospitals[matrix.row_of[min_id]], wait=min_wait)
+        final_max = dict(matrix.hospitals[matrix.row_of[max_id]], wait=max_wait)
         
         return {
             "min_hosp": final_min, "max_hosp": final_max, "avg": round(avg_wait, 1),
-            "min_spec": abs_min["s"], "max_spec": abs_max["s"]
+            "min_spec": SPECIALTY_IDS[min_col], "max_spec": SPECIALTY_IDS[max_col]
+        }
+
+# Columns of /api/matrix: the general wait first, then one per specialty
+MATRIX_COLUMNS = ("all", *SPECIALTY_IDS)
+# Hospital fields sent by /api/matrix; `wait` is its "all" column
+MATRIX_FIELDS = ("id", "name_es", "name_en", "city", "lat", "lng", "trend")
+INT16_MAX = np.iinfo(np.int16).max
+
+@app.get("/api/matrix")
+def get_matrix(
+    request: Request,
+    encoding: str = Query("base64", pattern="^(base64|json)$"),
+    matrix: WaitMatrix = Depends(get_wait_matrix)
+):
+    """
+    Every hospital × specialty wait in one response, for clients that switch specialty locally.
+
+    Hospital fields come once, as columns. `waits` is column-major (one run of `rows` values
+    per entry of `columns`), so a specialty is a contiguous slice: with `encoding=base64`
+    it is little-endian Int16 that maps straight onto an Int16Array. `stats` holds the
+    /api/stats aggregates of each column, with hospitals given by row.
+    """
+    def build():
+        packed = np.clip(np.vstack([matrix.base_wait, matrix.waits.T]), 0, INT16_MAX).astype("<i2")
+        if encoding == "base64":
+            waits = {"dtype": "int16", "data": base64.b64encode(packed.tobytes()).decode("ascii")}
+        else:
+            waits = {"dtype": "int16", "data": packed.tolist()}
+        return {
+            "version": matrix.version,
+            "rows": len(matrix),
+            "columns": list(MATRIX_COLUMNS),
+            "hospitals": {field: [h[field] for h in matrix.hospitals] for field in MATRIX_FIELDS},
+            "waits": waits,
+            "stats": {column: compact_stats(matrix, column) for column in MATRIX_COLUMNS},
+        }
+
+    return cached_json(request, "matrix", (encoding,), matrix.version, build)
+
+def compact_stats(matrix: WaitMatrix, specialty: str) -> dict:
+    """build_stats with each hospital replaced by its row and wait."""
+    stats = build_stats(matrix, specialty)
+    for key in ("min_hosp", "max_hosp"):
+        if stats[key] is not None:
+            stats[key] = {"row": matrix.row_of[stats[key]["id"]], "wait": stats[key]["wait"]}
+    return stats
+
+@app.get("/api/rankings")
+def get_rankings(
+    request: Request,
+    specialty: Optional[str] = None,
+    province: Optional[str] = None,
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    k: int = Query(10, ge=1, le=100),
+    hospital_id: Optional[int] = None,
+    matrix: WaitMatrix = Depends(get_wait_matrix)
+):
+    """
+    The `k` shortest (`order=asc`) or longest (`desc`) waits for `specialty`, optionally in one
+    province. Without a specialty, or with "all", it ranks every hospital × specialty pair.
+
+    With `hospital_id` the response also gives that hospital's rank and percentile, nationally
+    and in its own province (for "all", by its general wait). Everything is read from the
+    sorted indexes of the snapshot, never by scanning it.
+    """
+    specialty = specialty if specialty and specialty != "all" else None
+    if specialty is not None and specialty not in SPECIALTY_INDEX:
+        raise HTTPException(status_code=422, detail=f"Unknown specialty: {specialty}")
+    if hospital_id is not None and hospital_id not in matrix.row_of:
+        raise HTTPException(status_code=404, detail="Hospital not found")
+    province_norm = normalize_str(province) if province and province != "all" else None
+
+    def build():
+        rankings = matrix.rankings
+        longest = order == "desc"
+        if specialty is None:
+            pairs = rankings.top_pairs(range(1, len(MATRIX_COLUMNS)), k, province_norm, longest)
+        else:
+            col = SPECIALTY_INDEX[specialty] + 1
+            rows = rankings.top(col, k, province_norm, longest)
+            pairs = [(int(rankings.values[col, row]), int(row), col) for row in rows]
+        results = [
+            dict(matrix.hospitals[row], position=position, wait=wait, specialty=MATRIX_COLUMNS[col])
+            for position, (wait, row, col) in enumerate(pairs, start=1)
+        ]
+        response = {"specialty": specialty or "all", "province": province_norm, "order": order, "results": results}
+        if hospital_id is not None:
+            row = matrix.row_of[hospital_id]
+            col = SPECIALTY_INDEX[specialty] + 1 if specialty else GENERAL
+            response["hospital"] = {
+                "id": hospital_id, "wait": int(rankings.values[col, row]),
+                "national": rankings.rank(col, row),
+                "province": rankings.rank(col, row, matrix.province_norm[row]),
+            }
+        return response
+
+    return cached_json(request, "rankings", (specialty, province_norm, order, k, hospital_id), matrix.version, build)
+
+def json_floats(values) -> list:
+    """NaN-safe list for JSON: missing values become null."""
+    return [None if math.isnan(v) else round(float(v), 1) for v in values]
+
+@app.get("/api/history")
+def get_history(
+    request: Request,
+    hospital_id: Optional[int] = None,
+    specialty: str = "all",
+    start: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    end: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}$"),
+    window: int = Query(3, ge=1, le=36),
+    matrix: WaitMatrix = Depends(get_wait_matrix)
+):
+    """
+    Monthly series for one hospital, or the mean over all hospitals when no id is given,
+    with month-over-month deltas and a rolling mean over `window` periods.
+    """
+    def build():
+        if hospital_id is not None:
+            periods, values = history.series(hospital_id, specialty, start, end)
+        else:
+            periods, _, cube = history.cube(specialty, start, end)
+            present = (~np.isnan(cube)).sum(axis=1)
+            values = np.where(present > 0, np.nansum(cube, axis=1) / np.maximum(present, 1), np.nan)
+        return {
+            "hospital_id": hospital_id, "specialty": specialty, "periods": periods,
+            "wait": json_floats(values), "delta": json_floats(deltas(values)),
+            "rolling_mean": json_floats(rolling_mean(values, window)),
         }
 
+    params = (hospital_id, specialty, start, end, window)
+    return cached_json(request, "history", params, matrix.version, build)
+
+# --- Observability ---
+@app.get("/metrics", include_in_schema=False)
+def get_metrics(matrix: WaitMatrix = Depends(get_wait_matrix)):
+    """Prometheus text format: this process plus the scheduler's last published metrics."""
+    metrics.DATASET_VERSION.set(matrix.version)
+    metrics.HOSPITALS.set(len(matrix))
+    return Response(metrics.render_all(), media_type=metrics.CONTENT_TYPE)
+
+def profiling_access(request: Request):
+    """The profiling endpoints have no auth: 404 unless enabled, and for anyone but loopback clients."""
+    host = request.client.host if request.client else ""
+    try:
+        loopback = ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not (metrics.PROFILING_ENDPOINTS and loopback):
+        raise HTTPException(status_code=404)
+
+@app.get("/metrics/profiling", include_in_schema=False, dependencies=[Depends(profiling_access)])
+def get_profiling():
+    """Profiler settings and the cProfile captures of the last slow sampled requests."""
+    return {**metrics.profiler.settings(), "captures": list(metrics.profiler.captures)}
+
+@app.post("/metrics/profiling", include_in_schema=False, dependencies=[Depends(profiling_access)])
+def set_profiling(
+    sample_rate: Optional[float] = Query(None, ge=0, le=1),
+    slow_ms: Optional[float] = Query(None, ge=0)
+):
+    """Switch sampling on (e.g. `sample_rate=0.05`) or off (`0`) without restarting."""
+    return metrics.profiler.configure(sample_rate, slow_ms)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,392 @@
+"""
+Métricas en formato Prometheus y perfiles de las peticiones lentas.
+
+Every request is timed per route and counts the SQL statements it runs (through an
+engine event and a context variable, so a request that suddenly issues one query per
+row stands out in `saniradar_http_request_sql_statements`). Sync and ingest stages are
+timed with `stage_timer`; the scheduler runs in its own process, so it writes its
+metrics to data/metrics/scheduler.prom and /metrics serves them next to the API's.
+
+Requests can be sampled for cProfile at runtime (POST /metrics/profiling): a sampled
+request that ends up slower than `slow_ms` keeps its profile, readable from
+GET /metrics/profiling. With sampling off the cost per request is one comparison.
+Those two endpoints only exist with SANIRADAR_PROFILING_ENDPOINTS=1, and only for
+clients on the loopback interface.
+"""
+import abc
+import bisect
+import cProfile
+import functools
+import glob
+import inspect
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METRICS_DIR = os.path.join("data", "metrics")
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Defaults for the slow-request profiler; both can be changed at runtime
+SLOW_REQUEST_MS = float(os.environ.get("SANIRADAR_SLOW_MS", 500))
+PROFILE_SAMPLE_RATE = float(os.environ.get("SANIRADAR_PROFILE_RATE", 0))
+# /metrics/profiling can retune the profiler and shows source paths: off unless enabled, loopback only
+PROFILING_ENDPOINTS = os.environ.get("SANIRADAR_PROFILING_ENDPOINTS") == "1"
+# Profiles kept in memory, and functions shown in each one
+MAX_PROFILES = 20
+PROFILE_LINES = 30
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(abc.ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    @abc.abstractmethod
+    def samples(self, const: Dict[str, str]) -> List[str]:
+        """Exposition lines of every series, with the `const` labels appended."""
+
+    def render(self, const: Optional[Dict[str, str]] = None) -> str:
+        """The family in text exposition format, or "" while it has no samples."""
+        lines = self.samples(const or {})
+        if not lines:
+            return ""
+        return f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n" + "".join(lines)
+
+    def _label_text(self, const: Dict[str, str], values: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        names = (*self.labels, *const, *(n for n, _ in extra))
+        return _format_labels(names, (*values, *const.values(), *(v for _, v in extra)))
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def samples(self, const):
+        with self._lock:
+            series = list(self._series.items())
+        return [f"{self.name}{self._label_text(const, labels)} {_format_value(v)}\n" for labels, v in series]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._series[labels] = value
+
+
+class Histogram(Metric):
+    """Fixed buckets; each series is [count per bucket (+Inf last)..., sum, count]."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self, const):
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        lines = []
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), values):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{self._label_text(const, labels, (('le', le),))} {cumulative}\n")
+            lines.append(f"{self.name}_sum{self._label_text(const, labels)} {_format_value(values[-2])}\n")
+            lines.append(f"{self.name}_count{self._label_text(const, labels)} {values[-1]}\n")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, const: Optional[Dict[str, str]] = None) -> str:
+        return "".join(metric.render(const) for metric in self.metrics)
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.add(Histogram(
+    "saniradar_http_request_duration_seconds", "Time to serve a request, until the last body byte.",
+    ("method", "route", "status"),
+))
+REQUEST_STATEMENTS = registry.add(Histogram(
+    "saniradar_http_request_sql_statements", "SQL statements executed while serving a request.",
+    ("route",), STATEMENT_BUCKETS,
+))
+SLOW_REQUESTS = registry.add(Counter(
+    "saniradar_http_slow_requests_total", "Requests slower than the slow-request threshold.", ("route",),
+))
+PROFILES_CAPTURED = registry.add(Counter(
+    "saniradar_profiles_captured_total", "Slow requests whose cProfile capture was kept.", ("route",),
+))
+STAGE_DURATION = registry.add(Histogram(
+    "saniradar_stage_duration_seconds", "Duration of sync and ingest stages.", ("stage",), STAGE_BUCKETS,
+))
+STAGE_FAILURES = registry.add(Counter(
+    "saniradar_stage_failures_total", "Sync and ingest stages that raised.", ("stage",),
+))
+STAGE_LAST_SUCCESS = registry.add(Gauge(
+    "saniradar_stage_last_success_timestamp_seconds", "Unix time a stage last completed.", ("stage",),
+))
+SYNC_REPORTS = registry.add(Counter(
+    "saniradar_sync_reports_total", "Report files seen by the sync, by outcome.", ("outcome",),
+))
+STARTUP_SECONDS = registry.add(Gauge("saniradar_startup_seconds", "Time from import to the API being ready."))
+DATASET_VERSION = registry.add(Gauge("saniradar_dataset_version", "Dataset version being served."))
+HOSPITALS = registry.add(Gauge("saniradar_hospitals", "Hospitals in the dataset being served."))
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """Time a sync / ingest stage into saniradar_stage_duration_seconds."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.inc(1, stage)
+        raise
+    else:
+        STAGE_LAST_SUCCESS.set(time.time(), stage)
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage)
+
+
+# --- Textfiles (metrics of other processes) ---
+
+def write_textfile(name: str, directory: str = METRICS_DIR) -> None:
+    """Publish this process' metrics as `<directory>/<name>.prom`, labelled process=<name>."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.prom")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(registry.render({"process": name}))
+    os.replace(tmp, path)
+
+
+def _families(text: str) -> Dict[str, Tuple[List[str], List[str]]]:
+    """{family: (HELP/TYPE lines, sample lines)} of a text exposition, in order."""
+    families: Dict[str, Tuple[List[str], List[str]]] = {}
+    current = None
+    for line in text.splitlines(keepends=True):
+        if line.startswith("# HELP ") or line.startswith("# TYPE "):
+            current = line.split(" ", 3)[2]
+            families.setdefault(current, ([], []))[0].append(line)
+        elif line.strip() and current is not None:
+            families[current][1].append(line)
+    return families
+
+
+def render_all(directory: str = METRICS_DIR) -> str:
+    """This process' metrics plus every textfile, merged so each family appears once."""
+    merged = _families(registry.render())
+    for path in sorted(glob.glob(os.path.join(directory, "*.prom"))):
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        except OSError:
+            continue
+        for name, (header, samples) in _families(text).items():
+            if name in merged:
+                merged[name][1].extend(samples)
+            else:
+                merged[name] = (header, samples)
+    return "".join("".join(header) + "".join(samples) for header, samples in merged.values())
+
+
+# --- Per-request state ---
+
+class RequestState:
+    __slots__ = ("statements", "sampled", "profiles")
+
+    def __init__(self, sampled: bool):
+        self.statements = 0
+        self.sampled = sampled
+        self.profiles: List[cProfile.Profile] = []
+
+
+# Set by MetricsMiddleware; worker threads see it because Starlette copies the context into them
+_request: ContextVar[Optional[RequestState]] = ContextVar("saniradar_request", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    state = _request.get()
+    if state is not None:
+        state.statements += 1
+
+
+class Profiler:
+    """cProfile sampling of slow requests, configurable while the API runs."""
+
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, slow_ms: float = SLOW_REQUEST_MS,
+                 keep: int = MAX_PROFILES):
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.captures = deque(maxlen=keep)
+        self._random = random.Random()
+
+    def should_sample(self) -> bool:
+        return self.sample_rate > 0 and self._random.random() < self.sample_rate
+
+    def configure(self, sample_rate: Optional[float] = None, slow_ms: Optional[float] = None) -> dict:
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if slow_ms is not None:
+            self.slow_ms = slow_ms
+        return self.settings()
+
+    def settings(self) -> dict:
+        return {"sample_rate": self.sample_rate, "slow_ms": self.slow_ms, "captured": len(self.captures)}
+
+    def keep(self, method: str, route: str, elapsed_ms: float, statements: int,
+             profiles: List[cProfile.Profile]) -> None:
+        out = io.StringIO()
+        stats = pstats.Stats(profiles[0], stream=out)
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+        self.captures.append({
+            "at": datetime.now().isoformat(timespec="seconds"), "method": method, "route": route,
+            "ms": round(elapsed_ms, 1), "sql_statements": statements, "profile": out.getvalue(),
+        })
+        PROFILES_CAPTURED.inc(1, route)
+
+
+profiler = Profiler()
+
+
+def profiled(endpoint: Callable) -> Callable:
+    """
+    Run `endpoint` under cProfile when its request was sampled. It has to happen here, in
+    the thread that runs the endpoint: cProfile only sees the thread that enabled it.
+    """
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def run_async(*args, **kwargs):
+            state = _request.get()
+            if state is None or not state.sampled:
+                return await endpoint(*args, **kwargs)
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.disable()
+                state.profiles.append(profile)
+        return run_async
+
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        state = _request.get()
+        if state is None or not state.sampled:
+            return endpoint(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.disable()
+            state.profiles.append(profile)
+    return run
+
+
+class ProfiledRoute(APIRoute):
+    """Route class for the app (`app.router.route_class`) that makes every endpoint profilable."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, profiled(endpoint), **kwargs)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: latency and SQL statements per route template (not per URL, to keep
+    the number of series bounded). The request ends with its last body chunk, so
+    streamed responses are measured whole.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = RequestState(profiler.should_sample())
+        token = _request.set(state)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request.reset(token)
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_LATENCY.observe(elapsed, scope["method"], path, str(status))
+            REQUEST_STATEMENTS.observe(state.statements, path)
+            if elapsed * 1000 >= profiler.slow_ms:
+                SLOW_REQUESTS.inc(1, path)
+                logging.warning(f"Petición lenta: {scope['method']} {path} {elapsed * 1000:.0f} ms, "
+                                f"{state.statements} sentencias SQL")
+                if state.profiles:
+                    profiler.keep(scope["method"], path, elapsed * 1000, state.statements, state.profiles)
@@ -0,0 +1,149 @@
+from functools import lru_cache
+from sqlalchemy import Index, event
+from sqlmodel import Field, SQLModel
+from typing import Optional
+import unicodedata
+
+
+@lru_cache(maxsize=4096)
+def normalize_str(s: str) -> str:
+    """Simple normalization for accents and case."""
+    return "".join(c for c in unicodedata.normalize('NFD', s.lower()) if unicodedata.category(c) != 'Mn')
+
+
+# --- Models ---
+class Hospital(SQLModel, table=True):
+    # Hospitals are upserted by name and province when loading CSV extracts (names repeat across provinces)
+    __table_args__ = (Index("ix_hospital_name_province", "name_es", "province_norm", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    name_es: str
+    name_en: str
+    city: str
+    lat: float
+    lng: float
+    wait: int
+    trend: int
+    # normalize_str(city), filled in on write so province filters are an indexed equality lookup
+    province_norm: Optional[str] = Field(default=None, index=True, exclude=True)
+
+@event.listens_for(Hospital, "before_insert")
+@event.listens_for(Hospital, "before_update")
+def _fill_province_norm(mapper, connection, target):
+    target.province_norm = normalize_str(target.city)
+
+class SpecialtyData(SQLModel, table=True):
+    __table_args__ = (Index("ix_specialtydata_hospital_specialty", "hospital_id", "specialty_id", unique=True),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    hospital_id: int = Field(foreign_key="hospital.id")
+    specialty_id: str
+    wait: int
+
+class DatasetMeta(SQLModel, table=True):
+    """Small key/value table for dataset bookkeeping (e.g. the dataset version)."""
+    key: str = Field(primary_key=True)
+    value: int
+
+class DatasetChange(SQLModel, table=True):
+    """Hospitals changed by each dataset version (comma-separated ids), for incremental reloads."""
+    version: int = Field(primary_key=True)
+    hospital_ids: str
+
+# --- Catalogues ---
+SPECIALTIES = [
+    {"id": "allergy", "key": "spec-allergy"},
+    {"id": "pathology", "key": "spec-pathology"},
+    {"id": "anesthesia", "key": "spec-anesthesia"},
+    {"id": "angiology", "key": "spec-angiology"},
+    {"id": "digestive", "key": "spec-digestive"},
+    {"id": "cardio", "key": "spec-cardio"},
+    {"id": "cardiovascular-surgery", "key": "spec-cardiovascular-surgery"},
+    {"id": "general-surgery", "key": "spec-general-surgery"},
+    {"id": "maxillofacial", "key": "spec-maxillofacial"},
+    {"id": "trauma", "key": "spec-trauma"},
+    {"id": "pediatric-surgery", "key": "spec-pediatric-surgery"},
+    {"id": "plastic", "key": "spec-plastic"},
+    {"id": "thoracic", "key": "spec-thoracic"},
+    {"id": "dermo", "key": "spec-dermo"},
+    {"id": "endocrinology", "key": "spec-endocrinology"},
+    {"id": "pharmacology", "key": "spec-pharmacology"},
+    {"id": "geriatrics", "key": "spec-geriatrics"},
+    {"id": "hematology", "key": "spec-hematology"},
+    {"id": "immunology", "key": "spec-immunology"},
+    {"id": "occupational-medicine", "key": "spec-occupational-medicine"},
+    {"id": "family-medicine", "key": "spec-family-medicine"},
+    {"id": "rehab", "key": "spec-rehab"},
+    {"id": "intensive-care", "key": "spec-intensive-care"},
+    {"id": "internal-medicine", "key": "spec-internal-medicine"},
+    {"id": "forensic", "key": "spec-forensic"},
+    {"id": "nuclear-medicine", "key": "spec-nuclear-medicine"},
+    {"id": "preventive", "key": "spec-preventive"},
+    {"id": "nephrology", "key": "spec-nephrology"},
+    {"id": "pneumology", "key": "spec-pneumology"},
+    {"id": "neurosurgery", "key": "spec-neurosurgery"},
+    {"id": "neurophysiology", "key": "spec-neurophysiology"},
+    {"id": "neurology", "key": "spec-neurology"},
+    {"id": "gyn", "key": "spec-gyn"},
+    {"id": "ophthalmology", "key": "spec-ophthalmology"},
+    {"id": "medical-oncology", "key": "spec-medical-oncology"},
+    {"id": "radiation-oncology", "key": "spec-radiation-oncology"},
+    {"id": "ent", "key": "spec-ent"},
+    {"id": "pediatrics", "key": "spec-pediatrics"},
+    {"id": "psychiatry", "key": "spec-psychiatry"},
+    {"id": "radiology", "key": "spec-radiology"},
+    {"id": "rheumatology", "key": "spec-rheumatology"},
+    {"id": "urology", "key": "spec-urology"}
+]
+
+# Specialty names as they appear in SNS / regional extracts, lower-cased and without accents
+SPECIALTY_ALIASES = {
+    "alergologia": "allergy", "allergology": "allergy", "allergy": "allergy",
+    "anatomia patologica": "pathology", "pathology": "pathology",
+    "anestesiologia y reanimacion": "anesthesia", "anestesiologia": "anesthesia", "anesthesiology": "anesthesia",
+    "angiologia y cirugia vascular": "angiology", "cirugia vascular": "angiology", "angiology": "angiology",
+    "aparato digestivo": "digestive", "digestivo": "digestive", "gastroenterology": "digestive",
+    "cardiologia": "cardio", "cardiology": "cardio",
+    "cirugia cardiovascular": "cardiovascular-surgery", "cirugia cardiaca": "cardiovascular-surgery",
+    "cardiovascular surgery": "cardiovascular-surgery",
+    "cirugia general y del aparato digestivo": "general-surgery", "cirugia general": "general-surgery",
+    "general surgery": "general-surgery",
+    "cirugia oral y maxilofacial": "maxillofacial", "cirugia maxilofacial": "maxillofacial",
+    "maxillofacial surgery": "maxillofacial",
+    "cirugia ortopedica y traumatologia": "trauma", "traumatologia": "trauma", "traumatology": "trauma",
+    "cirugia pediatrica": "pediatric-surgery", "pediatric surgery": "pediatric-surgery",
+    "cirugia plastica, estetica y reparadora": "plastic", "cirugia plastica": "plastic", "plastic surgery": "plastic",
+    "cirugia toracica": "thoracic", "thoracic surgery": "thoracic",
+    "dermatologia medico-quirurgica y venereologia": "dermo", "dermatologia": "dermo", "dermatology": "dermo",
+    "endocrinologia y nutricion": "endocrinology", "endocrinologia": "endocrinology", "endocrinology": "endocrinology",
+    "farmacologia clinica": "pharmacology", "clinical pharmacology": "pharmacology",
+    "geriatria": "geriatrics", "geriatrics": "geriatrics",
+    "hematologia y hemoterapia": "hematology", "hematologia": "hematology", "hematology": "hematology",
+    "inmunologia": "immunology", "immunology": "immunology",
+    "medicina del trabajo": "occupational-medicine", "occupational medicine": "occupational-medicine",
+    "medicina familiar y comunitaria": "family-medicine", "family medicine": "family-medicine",
+    "medicina fisica y rehabilitacion": "rehab", "rehabilitacion": "rehab", "rehabilitation": "rehab",
+    "medicina intensiva": "intensive-care", "intensive care": "intensive-care",
+    "medicina interna": "internal-medicine", "internal medicine": "internal-medicine",
+    "medicina legal y forense": "forensic", "forensic medicine": "forensic",
+    "medicina nuclear": "nuclear-medicine", "nuclear medicine": "nuclear-medicine",
+    "medicina preventiva y salud publica": "preventive", "medicina preventiva": "preventive",
+    "preventive medicine": "preventive",
+    "nefrologia": "nephrology", "nephrology": "nephrology",
+    "neumologia": "pneumology", "pulmonology": "pneumology", "pneumology": "pneumology",
+    "neurocirugia": "neurosurgery", "neurosurgery": "neurosurgery",
+    "neurofisiologia clinica": "neurophysiology", "neurophysiology": "neurophysiology",
+    "neurologia": "neurology", "neurology": "neurology",
+    "obstetricia y ginecologia": "gyn", "ginecologia": "gyn", "gynecology": "gyn",
+    "oftalmologia": "ophthalmology", "ophthalmology": "ophthalmology",
+    "oncologia medica": "medical-oncology", "medical oncology": "medical-oncology",
+    "oncologia radioterapica": "radiation-oncology", "radiation oncology": "radiation-oncology",
+    "otorrinolaringologia": "ent", "orl": "ent", "otolaryngology": "ent", "ent": "ent",
+    "pediatria y sus areas especificas": "pediatrics", "pediatria": "pediatrics", "pediatrics": "pediatrics",
+    "psiquiatria": "psychiatry", "psychiatry": "psychiatry",
+    "radiodiagnostico": "radiology", "radiology": "radiology",
+    "reumatologia": "rheumatology", "rheumatology": "rheumatology",
+    "urologia": "urology", "urology": "urology",
+}
+# The ids themselves are valid names too
+SPECIALTY_ALIASES.update({s["id"]: s["id"] for s in SPECIALTIES})
@@ -0,0 +1,96 @@
+import heapq
+from itertools import islice, repeat
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from backend.wait_matrix import WaitMatrix
+
+# Column 0 is the hospital's general wait, then one column per specialty (as in /api/matrix)
+GENERAL = 0
+
+
+class RankingIndex:
+    """
+    Sorted orderings of a WaitMatrix, built once per snapshot.
+
+    For every column there is a national order and a province-major order (province,
+    then wait, then id), so the ranking of any province is one contiguous slice and
+    top-k is a slice of it. The sorted waits next to each order answer rank and
+    percentile lookups with a binary search. Ties resolve to the lowest id in both
+    directions, as in WaitStats.
+    """
+
+    def __init__(self, matrix: "WaitMatrix"):
+        # columns × hospitals, so each column's orders and waits are contiguous
+        self.values = np.ascontiguousarray(np.column_stack([matrix.base_wait, matrix.waits]).T)
+        self.ids = matrix.ids
+
+        names, codes = np.unique(np.array(matrix.province_norm, dtype=object), return_inverse=True)
+        codes = codes.reshape(-1)
+        self.province_code = {name: code for code, name in enumerate(names)}
+        # Province-major orders hold each province's hospitals in one run, from province_start[code]
+        self.province_start = np.r_[0, np.cumsum(np.bincount(codes, minlength=len(names)))]
+
+        # Rows are in id order, so a stable sort already breaks ties by id. Keys are narrowed
+        # to the smallest integer type that holds them: numpy radix-sorts 8/16-bit keys.
+        low = int(self.values.min()) if self.values.size else 0
+        span = int(self.values.max()) - low if self.values.size else 0
+        keys = (self.values - low).astype(np.min_scalar_type(span))
+        self.national = np.argsort(keys, axis=1, kind="stable").astype(np.int32)
+        codes = codes.astype(np.min_scalar_type(len(names)))
+        regroup = np.argsort(codes[self.national], axis=1, kind="stable")
+        self.by_province = np.take_along_axis(self.national, regroup, axis=1)
+        self.national_waits = np.take_along_axis(self.values, self.national, axis=1)
+        self.province_waits = np.take_along_axis(self.values, self.by_province, axis=1)
+
+    def _slice(self, col: int, province: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, waits) of one column, sorted by wait: national, or one province's run."""
+        if province is None:
+            return self.national[col], self.national_waits[col]
+        code = self.province_code.get(province)
+        if code is None:
+            return self.national[col][:0], self.national_waits[col][:0]
+        start, stop = self.province_start[code], self.province_start[code + 1]
+        return self.by_province[col][start:stop], self.province_waits[col][start:stop]
+
+    def top(self, col: int, k: int, province: Optional[str] = None, longest: bool = False) -> np.ndarray:
+        """Rows of the `k` shortest (or longest) waits in `col`, ties by lowest id."""
+        rows, waits = self._slice(col, province)
+        if not longest:
+            return rows[:k]
+        if len(rows) > k:
+            # Everything above the k-th longest wait, plus the lowest ids among those tied with it
+            kth = waits[len(rows) - k]
+            lo, hi = np.searchsorted(waits, kth, side="left"), np.searchsorted(waits, kth, side="right")
+            rows = np.concatenate([rows[hi:], rows[lo:lo + k - (len(rows) - hi)]])
+        return rows[np.lexsort((rows, -self.values[col, rows]))]
+
+    def top_pairs(self, cols: range, k: int, province: Optional[str] = None,
+                  longest: bool = False) -> List[Tuple[int, int, int]]:
+        """
+        The `k` best (wait, row, col) pairs across `cols`, merging the head of each sorted
+        column with a heap: only k candidates per column are ever looked at.
+        """
+        sign = -1 if longest else 1
+        runs = []
+        for col in cols:
+            rows = self.top(col, k, province, longest)
+            # Tuples compare as (wait, row, col): shortest first, or longest with the sign flipped
+            runs.append(zip((sign * self.values[col, rows]).tolist(), rows.tolist(), repeat(col)))
+        return [(sign * wait, row, col) for wait, row, col in islice(heapq.merge(*runs), k)]
+
+    def rank(self, col: int, row: int, province: Optional[str] = None) -> dict:
+        """
+        Position of one hospital in a column: `rank` 1 is the shortest wait (ties share a
+        rank) and `percentile` is the share of hospitals waiting less, counting ties as half.
+        """
+        _, waits = self._slice(col, province)
+        wait = self.values[col, row]
+        below = int(np.searchsorted(waits, wait, side="left"))
+        equal = int(np.searchsorted(waits, wait, side="right")) - below
+        return {
+            "rank": below + 1, "of": len(waits),
+            "percentile": round(100 * (below + equal / 2) / len(waits), 1) if len(waits) else None,
+        }
@@ -0,0 +1,251 @@
+"""
+Parsing of the downloaded SNS reports into the extract shape the loader understands
+(hospital, city, specialty, wait_days, last_month_wait).
+
+Each community publishes its own file (XLSX, CSV or PDF tables) with its own headers, so
+the header row is located by matching known column names. Parsing is CPU bound and
+files are independent: cache misses fan out over a ProcessPoolExecutor, and every parsed
+file is cached under data/parsed keyed by the hash of its content, so a resync only
+re-parses the reports that actually changed.
+
+    python -m backend.report_parser [reports_dir] [period]
+"""
+import csv
+import hashlib
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from backend.models import SPECIALTY_ALIASES, normalize_str
+
+try:
+    import pdfplumber
+except ImportError:  # PDF reports are skipped without it
+    pdfplumber = None
+
+PARSED_DIR = os.path.join("data", "parsed")
+# Bump when the output of parse_report changes, so old cache entries are ignored
+PARSER_VERSION = 1
+HASH_CHUNK = 1024 * 1024
+# Rows scanned looking for the header: reports start with a title block
+HEADER_SCAN_ROWS = 30
+
+OUTPUT_COLUMNS = ["hospital", "city", "specialty", "wait_days", "last_month_wait"]
+
+# Normalized header text (see normalize_str) -> loader column
+HEADER_ALIASES = {
+    "hospital": "hospital", "centro": "hospital", "centro hospitalario": "hospital",
+    "nombre del centro": "hospital", "hospital / centro": "hospital",
+    "city": "city", "provincia": "city", "localidad": "city", "municipio": "city", "ciudad": "city",
+    "specialty": "specialty", "especialidad": "specialty", "servicio": "specialty",
+    "wait_days": "wait_days", "demora": "wait_days", "demora media": "wait_days",
+    "demora media (dias)": "wait_days", "tiempo medio de espera": "wait_days",
+    "tiempo medio de espera (dias)": "wait_days", "dias de espera": "wait_days",
+    "last_month_wait": "last_month_wait", "demora mes anterior": "last_month_wait",
+    "mes anterior": "last_month_wait", "demora media mes anterior": "last_month_wait",
+    "lat": "lat", "latitud": "lat", "lng": "lng", "longitud": "lng",
+}
+REQUIRED = {"hospital", "wait_days"}
+
+
+@dataclass
+class ParseResult:
+    frames: List[Tuple[str, str]] = field(default_factory=list)  # (source path, cached rows); read by iter_frames
+    cached: int = 0
+    parsed: int = 0
+    skipped: List[str] = field(default_factory=list)
+
+
+def content_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_path(digest: str, cache_dir: str = PARSED_DIR) -> str:
+    return os.path.join(cache_dir, f"{digest}.v{PARSER_VERSION}.pkl")
+
+
+def read_raw(path: str) -> Optional[pd.DataFrame]:
+    """Every cell of the report as text, without assuming where the header is."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        for encoding in ("utf-8-sig", "latin-1"):
+            try:
+                with open(path, encoding=encoding, newline="") as f:
+                    first = f.readline()
+                    f.seek(0)
+                    sep = ";" if first.count(";") > first.count(",") else ","
+                    # Title lines have fewer cells than the table: csv copes with ragged rows
+                    return pd.DataFrame([row for row in csv.reader(f, delimiter=sep) if any(row)], dtype=str)
+            except UnicodeDecodeError:
+                continue
+        return None
+    if ext in (".xlsx", ".xls"):
+        # openpyxl reads .xlsx, xlrd the legacy .xls workbooks (both in requirements.txt)
+        sheets = pd.read_excel(path, sheet_name=None, header=None, dtype=str)
+        return pd.concat(sheets.values(), ignore_index=True) if sheets else None
+    if ext == ".pdf":
+        if pdfplumber is None:
+            logging.warning(f"pdfplumber no está instalado: se omite {path}")
+            return None
+        rows = []
+        with pdfplumber.open(path) as pdf:
+            for page in pdf.pages:
+                for table in page.extract_tables():
+                    rows.extend(table)
+        return pd.DataFrame(rows, dtype=str) if rows else None
+    return None
+
+
+def header_columns(row) -> dict:
+    """{position: loader column} for the cells of `row` that are known headers."""
+    found = {}
+    for i, cell in enumerate(row):
+        if isinstance(cell, str):
+            column = HEADER_ALIASES.get(" ".join(normalize_str(cell).split()))
+            if column and column not in found.values():
+                found[i] = column
+    return found
+
+
+def to_number(values: pd.Series) -> pd.Series:
+    """Numbers to floats, also in Spanish format ("1.234,5"); NaN when not a number."""
+    text = values.astype("string").str.strip()
+    spanish = text.str.contains(",", regex=False).fillna(False)
+    text = text.where(~spanish, text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(text, errors="coerce")
+
+
+def normalize(raw: pd.DataFrame, source: str = "") -> pd.DataFrame:
+    """Locate the header row of a raw report and return its rows in OUTPUT_COLUMNS shape."""
+    for i in range(min(HEADER_SCAN_ROWS, len(raw))):
+        columns = header_columns(raw.iloc[i].tolist())
+        if REQUIRED <= set(columns.values()):
+            break
+    else:
+        raise ValueError(f"No header with {sorted(REQUIRED)} found in {source or 'report'}")
+
+    body = raw.iloc[i + 1:, list(columns)]
+    body.columns = list(columns.values())
+    out = pd.DataFrame(index=body.index)
+    out["hospital"] = body["hospital"].astype("string").str.strip()
+    out["city"] = body["city"].astype("string").str.strip() if "city" in body else ""
+    out["wait_days"] = to_number(body["wait_days"]).round()
+    out["last_month_wait"] = to_number(body["last_month_wait"]).round() if "last_month_wait" in body else float("nan")
+    for coord in ("lat", "lng"):
+        if coord in body:
+            out[coord] = pd.to_numeric(body[coord].astype("string").str.replace(",", ".", regex=False), errors="coerce")
+
+    # Specialty names become SPECIALTIES ids; an empty cell is a hospital-level figure
+    if "specialty" in body:
+        names = body["specialty"].astype("string").str.strip()
+        ids = names.map(lambda n: SPECIALTY_ALIASES.get(normalize_str(n)) if isinstance(n, str) else None)
+        unknown = names.notna() & (names != "") & ids.isna()
+        if unknown.any():
+            logging.warning(f"{source}: {int(unknown.sum())} filas con especialidad desconocida "
+                            f"({', '.join(names[unknown].unique()[:5])})")
+        out["specialty"] = ids
+        out = out[~unknown]
+    else:
+        out["specialty"] = None
+
+    # Repeated header rows (one per page in PDFs), totals and blank lines have no wait
+    out = out[out["hospital"].notna() & (out["hospital"] != "") & out["wait_days"].notna()]
+    columns = OUTPUT_COLUMNS + [c for c in ("lat", "lng") if c in out]
+    return out[columns].reset_index(drop=True)
+
+
+def parse_report(path: str) -> Optional[pd.DataFrame]:
+    raw = read_raw(path)
+    if raw is None or raw.empty:
+        return None
+    return normalize(raw, os.path.basename(path))
+
+
+def parse_to_cache(path: str, target: str) -> Optional[str]:
+    """Worker: parse one report and store the rows at `target`. None if it had no data."""
+    frame = parse_report(path)
+    if frame is None:
+        return None
+    tmp = f"{target}.{os.getpid()}.tmp"
+    frame.to_pickle(tmp)
+    os.replace(tmp, target)
+    return target
+
+
+def run_safely(parse, path: str, target: str) -> Optional[str]:
+    try:
+        return parse(path, target)
+    except Exception as e:
+        logging.error(f"Error procesando {path}: {e}")
+        return None
+
+
+def parse_reports(paths: List[str], cache_dir: str = PARSED_DIR, workers: Optional[int] = None) -> ParseResult:
+    """
+    Parse `paths` into extract-shaped frames, in the same order. The frames stay in the
+    cache; `result.frames` lists where, and iter_frames reads them back one by one.
+
+    Files whose content hash is already in `cache_dir` are not parsed again; the
+    rest are parsed in parallel with one process per core (or `workers`).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    result = ParseResult()
+    targets = [cache_path(content_hash(p), cache_dir) for p in paths]
+    # Identical files share one cache entry and are parsed once
+    misses = {t: p for p, t in zip(paths, targets) if not os.path.exists(t)}
+    result.cached = sum(1 for t in targets if t not in misses)
+
+    done = {}
+    if len(misses) == 1:
+        # Not worth starting a pool for the usual monthly update of one file
+        done = {t: run_safely(parse_to_cache, p, t) for t, p in misses.items()}
+    elif misses:
+        workers = min(workers or os.cpu_count() or 1, len(misses))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {t: pool.submit(run_safely, parse_to_cache, p, t) for t, p in misses.items()}
+        done = {t: future.result() for t, future in futures.items()}
+    result.parsed = sum(1 for t in done.values() if t)
+
+    for path, target in zip(paths, targets):
+        if target in done and done[target] is None:
+            result.skipped.append(path)
+            continue
+        result.frames.append((path, target))
+    return result
+
+
+def report_files(root: str) -> List[str]:
+    from backend.sync_service import REPORT_EXTENSIONS
+    if not os.path.isdir(root):
+        return []
+    return sorted(os.path.join(root, name) for name in os.listdir(root)
+                  if name.lower().endswith(REPORT_EXTENSIONS))
+
+
+def iter_frames(result: ParseResult) -> Iterator[pd.DataFrame]:
+    """Parsed rows one report at a time, so a national import only holds the report being loaded."""
+    for _, target in result.frames:
+        yield pd.read_pickle(target)
+
+
+if __name__ == "__main__":
+    from backend.load_data import load_frames
+    from backend.sync_service import REPORTS_DIR
+
+    args = sys.argv[1:]
+    files = report_files(args[0] if args else REPORTS_DIR)
+    start = time.perf_counter()
+    parsed = parse_reports(files)
+    print(f"Parsed {len(files)} reports in {time.perf_counter() - start:.2f}s "
+          f"({parsed.parsed} parsed, {parsed.cached} from cache, {len(parsed.skipped)} skipped).")
+    load_frames(iter_frames(parsed), period=args[1] if len(args) > 1 else None)
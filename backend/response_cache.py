@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, NamedTuple
+
+from fastapi import Request, Response
+
+# Entries for the current dataset version; older versions are dropped as soon as a newer one shows up
+MAX_ENTRIES = 512
+
+
+class CachedBody(NamedTuple):
+    body: bytes
+    gzip_body: bytes
+    etag: str
+
+
+def serialize(content) -> CachedBody:
+    """Serialize like FastAPI's JSONResponse, gzip once and derive a strong ETag from the bytes."""
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:32]
+    return CachedBody(body, gzip.compress(body, compresslevel=6, mtime=0), f'"{digest}"')
+
+
+class ResponseCache:
+    """Pre-serialized JSON bodies keyed by (endpoint, params, dataset version)."""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, CachedBody]" = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get_or_build(self, endpoint: str, params: Hashable, version: int, build: Callable[[], object]) -> CachedBody:
+        key = (endpoint, params, version)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                return cached
+        # Build outside the lock; two threads racing on a cold key just serialize twice
+        cached = serialize(build())
+        with self._lock:
+            if self._version is None or version > self._version:
+                self._version = version
+                self._entries.clear()
+            if version == self._version:
+                self._entries[key] = cached
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return cached
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+
+response_cache = ResponseCache()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match; the gzip variant carries a suffix
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """True if Accept-Encoding allows gzip: listed (or `*`) with a q-value above zero."""
+    allowed = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding:
+            allowed[coding.strip().lower()] = q > 0
+    return allowed.get("gzip", allowed.get("x-gzip", allowed.get("*", False)))
+
+
+def cached_json(request: Request, endpoint: str, params: Hashable, version: int,
+                build: Callable[[], object]) -> Response:
+    """
+    Serve `build()` as JSON through the response cache, answering conditional requests
+    with 304 and using the precompressed body when the client accepts gzip.
+    """
+    cached = response_cache.get_or_build(endpoint, params, version, build)
+    use_gzip = accepts_gzip(request.headers.get("accept-encoding", ""))
+    # Strong ETags must differ between encodings of the same resource
+    etag = f'{cached.etag[:-1]}-gz"' if use_gzip else cached.etag
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(cached.gzip_body, media_type="application/json", headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
@@ -0,0 +1,264 @@
+"""
+Sincronización periódica con el portal del SNS, fuera del proceso de la API.
+
+    python -m backend.scheduler            # bucle: sincroniza cada SYNC_INTERVAL segundos
+    python -m backend.scheduler --once     # una sola pasada
+    python -m backend.scheduler --full     # recarga todos los informes, no solo los nuevos
+
+Any number of schedulers (and API workers) can run: a lease file in data/ elects the one
+that talks to the ministry, and the others stand by until it expires. A cycle downloads
+the changed reports, parses them, loads them into a copy of the published database and
+publishes that copy through the pointer in backend/database.py. API processes never
+wait on the ingest: they keep serving the old file until their next version check.
+"""
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from backend.database import DATA_DIR, active_db_path, make_engine, publish_db
+from backend.load_data import load_frames
+from backend.metrics import stage_timer, write_textfile
+from backend.report_parser import iter_frames, parse_reports, report_files
+from backend.sync_service import REPORTS_DIR, sync_reports
+from backend.versioning import raise_version_above, read_version
+
+LEASE_PATH = os.path.join(DATA_DIR, "scheduler.lease")
+# A holder that stops renewing (crash, killed) is replaced after this many seconds
+LEASE_TTL = 120
+SYNC_INTERVAL = 24 * 60 * 60
+SNAPSHOT_PREFIX = "saniradar-"
+# Published files kept besides the current one, for readers still switching over
+KEEP_PREVIOUS = 1
+
+
+class Lease:
+    """
+    Exclusive, expiring lease held in a file, usable from any OS (no fcntl / msvcrt).
+
+    Creating the file with O_EXCL takes a free lease; an expired one is taken by renaming
+    it away first, which only one contender can do, and checking that what was renamed is
+    still the expired lease (another contender may have replaced it since it was read).
+    The holder renews it from a background thread; if it ever finds another owner in the
+    file it sets `lost`. Renew once more right before acting on the lease: a successful
+    renew leaves a whole `ttl` before anyone else can take it.
+    """
+
+    def __init__(self, path: str = LEASE_PATH, ttl: float = LEASE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lost = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read(self, path: Optional[str] = None) -> Optional[dict]:
+        try:
+            with open(path or self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _content(self) -> str:
+        return json.dumps({"owner": self.owner, "expires": time.time() + self.ttl})
+
+    def acquire(self) -> bool:
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            current = self._read()
+            if current and current.get("owner") == self.owner:
+                return self.renew()
+            if current and current.get("expires", 0) > time.time():
+                return False
+            # Expired or unreadable: take it over, but only one contender wins the rename
+            stale = f"{self.path}.{os.getpid()}.stale"
+            try:
+                os.rename(self.path, stale)
+            except OSError:
+                return False
+            if self._read(stale) != current:
+                # Another contender took the lease over between our read and the rename: give it back
+                os.replace(stale, self.path)
+                return False
+            os.remove(stale)
+            return self.acquire()
+        with os.fdopen(fd, "w") as f:
+            f.write(self._content())
+        self.lost.clear()
+        self._start_heartbeat()
+        return True
+
+    def renew(self) -> bool:
+        current = self._read()
+        if not current or current.get("owner") != self.owner:
+            self.lost.set()
+            return False
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self._content())
+        os.replace(tmp, self.path)
+        return True
+
+    def _start_heartbeat(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def beat():
+            while not self._stop.wait(self.ttl / 3):
+                if not self.renew():
+                    logging.warning("El lease del planificador ha pasado a otro proceso")
+                    return
+
+        self._thread = threading.Thread(target=beat, daemon=True)
+        self._thread.start()
+
+    def release(self) -> None:
+        self._stop.set()
+        current = self._read()
+        if current and current.get("owner") == self.owner:
+            os.remove(self.path)
+
+
+def copy_database(source: str, target: str) -> None:
+    """Consistent copy of a live SQLite file (backup API), even while it is being read."""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def staging_path() -> str:
+    return os.path.join(DATA_DIR, f"{SNAPSHOT_PREFIX}{datetime.now():%Y%m%d-%H%M%S}.db")
+
+
+def build_and_publish(frames, lease: Optional[Lease] = None, period: Optional[str] = None) -> Optional[str]:
+    """
+    Load `frames` into a copy of the published database and publish the copy.
+
+    Copying (rather than starting empty) keeps hospital ids stable, which the history
+    store relies on. Returns the new file, or None if the lease was lost meanwhile.
+    """
+    live = active_db_path()
+    staging = staging_path()
+    has_live = os.path.exists(live)
+    if has_live:
+        copy_database(live, staging)
+    engine = make_engine(staging)
+    try:
+        load_frames(frames, engine, period)
+        live_version = 0
+        if has_live:
+            live_engine = make_engine(live)
+            with live_engine.connect() as conn:
+                live_version = read_version(conn)
+            live_engine.dispose()
+        with engine.begin() as conn:
+            raise_version_above(conn, live_version)
+    finally:
+        engine.dispose()
+
+    # The heartbeat only notices a lost lease every ttl/3; a short cycle must not publish on its word
+    if lease is not None and not lease.renew():
+        logging.warning(f"Lease perdido durante la carga: se descarta {staging}")
+        for path in (staging, staging + "-wal", staging + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+        return None
+    publish_db(staging)
+    prune_snapshots()
+    return staging
+
+
+def prune_snapshots(keep: int = KEEP_PREVIOUS) -> None:
+    """Delete published files older than the current one and the `keep` before it."""
+    current = os.path.basename(active_db_path())
+    snapshots = sorted(glob.glob(os.path.join(DATA_DIR, f"{SNAPSHOT_PREFIX}*.db")))
+    names = [os.path.basename(p) for p in snapshots]
+    if current not in names:
+        return
+    for path in snapshots[:max(names.index(current) - keep, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            # Still open somewhere (Windows): next cycle will retry
+            continue
+        for sidecar in (path + "-wal", path + "-shm"):
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+
+
+def run_cycle(lease: Optional[Lease] = None, full: bool = False, period: Optional[str] = None) -> Optional[str]:
+    """Sync, parse and publish once. Returns the published file, or None if nothing changed."""
+    logging.info(f"[{datetime.now()}] Iniciando búsqueda automática de actualizaciones en el portal del SNS...")
+    try:
+        with stage_timer("sync"):
+            result = asyncio.run(sync_reports())
+    except Exception as e:
+        logging.error(f"Error al conectar con el portal de Sanidad: {e}")
+        if not full:
+            return None
+        result = None
+
+    files = report_files(REPORTS_DIR)
+    paths = files if full else [p for p in files if p in set(result.downloaded)]
+    if not paths:
+        logging.info("Resultado: Los datos actuales están al día. No se requiere actualización.")
+        return None
+
+    start = time.perf_counter()
+    with stage_timer("parse"):
+        parsed = parse_reports(paths)
+    logging.info(f"{len(paths)} informes procesados ({parsed.cached} en caché, {len(parsed.skipped)} omitidos) "
+                 f"en {time.perf_counter() - start:.1f}s")
+    if not parsed.frames:
+        return None
+    with stage_timer("publish"):
+        published = build_and_publish(iter_frames(parsed), lease, period)
+    if published:
+        logging.info(f"Publicada {published} en {time.perf_counter() - start:.1f}s")
+    return published
+
+
+def main(once: bool = False, full: bool = False, interval: float = SYNC_INTERVAL) -> None:
+    lease = Lease()
+    try:
+        while True:
+            if lease.acquire():
+                try:
+                    run_cycle(lease, full)
+                finally:
+                    # Read by /metrics in the API processes
+                    write_textfile("scheduler")
+                full = False
+                wait = interval
+            else:
+                logging.info("Otro planificador tiene el lease; en espera")
+                wait = lease.ttl
+            if once:
+                break
+            time.sleep(wait)
+    finally:
+        lease.release()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--once", action="store_true", help="run a single cycle and exit")
+    parser.add_argument("--full", action="store_true", help="reload every downloaded report")
+    parser.add_argument("--interval", type=float, default=SYNC_INTERVAL, help="seconds between cycles")
+    args = parser.parse_args()
+    main(args.once, args.full, args.interval)
@@ -0,0 +1,83 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+from sqlmodel import SQLModel
+
+from backend.database import write_lock
+from backend.models import Hospital, SpecialtyData, normalize_str
+from backend.versioning import SCHEMA_VERSION, bump_version, read_meta, write_meta
+
+# Increment when upgrade_schema learns a new step, so existing databases run it once
+CURRENT_SCHEMA = 3
+
+
+def schema_is_current(engine) -> bool:
+    with engine.connect() as conn:
+        return _schema_is_current(conn)
+
+
+def _schema_is_current(conn) -> bool:
+    if not inspect(conn).has_table("datasetmeta"):
+        return False
+    return read_meta(conn, SCHEMA_VERSION) == CURRENT_SCHEMA
+
+
+def upgrade_schema(engine):
+    """
+    Bring a database created by an older version up to the current models.
+
+    `create_all` only creates missing tables, so indexes added to existing tables are
+    created here, as are columns added to Hospital. The unique indexes need duplicates
+    gone first: like the old `.first()` lookups, the oldest row wins.
+
+    The schema version stored in DatasetMeta makes this a single lookup once done. The
+    upgrade itself runs under the write lock and re-checks the version there, so uvicorn
+    workers starting together on a fresh database upgrade it once.
+    """
+    if schema_is_current(engine):
+        return
+    try:
+        with write_lock(engine) as conn:
+            if _schema_is_current(conn):
+                return
+            _upgrade(conn)
+    except OperationalError as e:
+        # A process without the lock (an older version) got there first: fine if it finished
+        if "already exists" not in str(e) or not schema_is_current(engine):
+            raise
+
+
+def _upgrade(conn):
+    SQLModel.metadata.create_all(conn)
+    columns = {c["name"] for c in inspect(conn).get_columns("hospital")}
+    if "province_norm" not in columns:
+        conn.execute(text("ALTER TABLE hospital ADD COLUMN province_norm VARCHAR"))
+    backfill_province_norm(conn)
+
+    removed = conn.execute(text(
+        "DELETE FROM hospital WHERE id NOT IN (SELECT MIN(id) FROM hospital GROUP BY name_es, province_norm)"
+    )).rowcount
+    removed += conn.execute(text(
+        "DELETE FROM specialtydata WHERE hospital_id NOT IN (SELECT id FROM hospital) "
+        "OR id NOT IN (SELECT MIN(id) FROM specialtydata GROUP BY hospital_id, specialty_id)"
+    )).rowcount
+    if removed:
+        bump_version(conn)
+        logging.warning(f"Esquema: eliminadas {removed} filas duplicadas antes de crear índices únicos")
+    # Hospitals used to be unique by name alone, which merged same-named centres of different provinces
+    conn.execute(text("DROP INDEX IF EXISTS ix_hospital_name_es"))
+    for table in (Hospital.__table__, SpecialtyData.__table__):
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+    write_meta(conn, SCHEMA_VERSION, CURRENT_SCHEMA)
+
+
+def backfill_province_norm(conn):
+    """Fill province_norm for rows written without the ORM hook (older versions, raw SQL)."""
+    cities = conn.execute(text("SELECT DISTINCT city FROM hospital WHERE province_norm IS NULL")).scalars().all()
+    if cities:
+        conn.execute(
+            text("UPDATE hospital SET province_norm = :norm WHERE city = :city AND province_norm IS NULL"),
+            [{"norm": normalize_str(city), "city": city} for city in cities],
+        )
@@ -0,0 +1,66 @@
+"""
+Datos iniciales (hospitales de referencia y algunas demoras reales por especialidad),
+cargados desde data/seed/seed.json.
+
+The file carries a version; the version loaded is stored in DatasetMeta, so a startup
+with the same seed costs one lookup. Editing the seed means bumping "version".
+"""
+import json
+import logging
+import os
+
+from sqlalchemy import delete, insert, select
+
+from backend.database import write_lock
+from backend.models import Hospital, SpecialtyData, normalize_str
+from backend.versioning import SEED_VERSION, bump_version, read_meta, write_meta
+
+SEED_PATH = os.path.join("data", "seed", "seed.json")
+
+
+def read_seed(path: str = SEED_PATH) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def seed_database(engine, path: str = SEED_PATH) -> bool:
+    """
+    Load the seed if the database does not hold this version of it yet. Returns True if it did.
+
+    A database with hospitals that are not in the seed holds a real dataset (loaded with
+    backend.load_data or published by the scheduler) and is never overwritten. Otherwise
+    both tables are replaced in bulk, in one transaction, with ids in file order.
+    """
+    seed = read_seed(path)
+    version = seed["version"]
+    hospital_table, specialty_table = Hospital.__table__, SpecialtyData.__table__
+    with engine.connect() as conn:
+        if read_meta(conn, SEED_VERSION) == version:
+            return False
+    # Several workers may boot at once on a fresh database: one seeds, the others re-check and skip
+    with write_lock(engine) as conn:
+        if read_meta(conn, SEED_VERSION) == version:
+            return False
+
+        seed_names = {h["name_es"] for h in seed["hospitals"]}
+        existing = conn.execute(select(hospital_table.c.name_es)).scalars().all()
+        if any(name not in seed_names for name in existing):
+            logging.info(f"Semilla v{version} omitida: la base de datos ya contiene un conjunto de datos cargado")
+            write_meta(conn, SEED_VERSION, version)
+            return False
+
+        ids = {h["name_es"]: i for i, h in enumerate(seed["hospitals"], start=1)}
+        conn.execute(delete(specialty_table))
+        conn.execute(delete(hospital_table))
+        conn.execute(insert(hospital_table), [
+            {**h, "id": ids[h["name_es"]], "province_norm": normalize_str(h["city"])} for h in seed["hospitals"]
+        ])
+        if seed["specialties"]:
+            conn.execute(insert(specialty_table), [
+                {"hospital_id": ids[s["hospital"]], "specialty_id": s["specialty_id"], "wait": s["wait"]}
+                for s in seed["specialties"]
+            ])
+        write_meta(conn, SEED_VERSION, version)
+        bump_version(conn)
+    logging.info(f"Semilla v{version} cargada: {len(ids)} hospitales, {len(seed['specialties'])} demoras por especialidad")
+    return True
@@ -0,0 +1,155 @@
+"""
+Servidor local que imita el portal de listas de espera del Ministerio.
+
+Sirve una página de listado con enlaces a los ficheros de un directorio y los propios
+ficheros con ETag / Last-Modified, respondiendo 304 a las peticiones condicionales, para
+probar y medir la sincronización sin red:
+
+    python -m backend.sns_fixture_server --generate 17 --rows 20000
+    SANIRADAR_MINISTRY_URL=http://127.0.0.1:8765/estadEstudios/estadisticas/sisInfSanSNS/listasEspera.htm
+"""
+import argparse
+import hashlib
+import html
+import os
+import random
+import shutil
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+import pandas as pd
+
+FIXTURE_DIR = os.path.join("data", "fixtures", "sns")
+INDEX_PATH = "/estadEstudios/estadisticas/sisInfSanSNS/listasEspera.htm"
+FILES_PATH = "/estadEstudios/estadisticas/sisInfSanSNS/informes/"
+DEFAULT_PORT = 8765
+
+COMMUNITIES = [
+    "Andalucia", "Aragon", "Asturias", "Baleares", "Canarias", "Cantabria", "Castilla-La Mancha",
+    "Castilla y Leon", "Cataluna", "Comunidad Valenciana", "Extremadura", "Galicia", "Madrid",
+    "Murcia", "Navarra", "Pais Vasco", "La Rioja",
+]
+SPECIALTY_NAMES = [
+    "Traumatología", "Oftalmología", "Dermatología", "Ginecología", "Urología", "Cardiología",
+    "Neurología", "Aparato Digestivo", "Otorrinolaringología", "Cirugía General",
+]
+
+
+def make_fixture_reports(root: str = FIXTURE_DIR, count: int = len(COMMUNITIES), rows: int = 1000,
+                         seed: int = 0) -> list:
+    """Write `count` synthetic community reports (CSV, same columns as the scraper output)."""
+    os.makedirs(root, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        community = COMMUNITIES[i % len(COMMUNITIES)]
+        n_hosp = max(1, rows // len(SPECIALTY_NAMES))
+        data = []
+        for r in range(rows):
+            wait = rng.randint(5, 250)
+            data.append({
+                "hospital": f"Hosp. {community} {i}-{r % n_hosp}",
+                "city": community,
+                "specialty": SPECIALTY_NAMES[r % len(SPECIALTY_NAMES)],
+                "wait_days": wait,
+                "last_month_wait": max(1, wait + rng.randint(-15, 15)),
+            })
+        path = os.path.join(root, f"listas_espera_{i:02d}_{community.replace(' ', '_')}.csv")
+        pd.DataFrame(data).to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _not_modified(self, etag: str, mtime: float) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _send(self, status: int, etag: str, mtime: float, length: int = 0, content_type: str = None):
+        self.send_response(status)
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", formatdate(mtime, usegmt=True))
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def do_GET(self):
+        root = self.server.root
+        path = unquote(urlparse(self.path).path)
+        if path in (INDEX_PATH, "/"):
+            names = sorted(n for n in os.listdir(root) if not n.startswith("."))
+            # Like the real portal, the listing shows each file's date, so it changes with them
+            items = "\n".join(
+                f'<li><a href="{FILES_PATH}{quote(n)}">{html.escape(n)}</a> '
+                f'({formatdate(os.stat(os.path.join(root, n)).st_mtime, usegmt=True)})</li>'
+                for n in names
+            )
+            body = f"<html><body><h1>Listas de espera</h1><ul>\n{items}\n</ul></body></html>".encode()
+            etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+            mtime = max([os.stat(os.path.join(root, n)).st_mtime for n in names] or [0])
+            if self._not_modified(etag, mtime):
+                return self._send(304, etag, mtime)
+            self._send(200, etag, mtime, len(body), "text/html; charset=utf-8")
+            self.wfile.write(body)
+            return
+
+        if not path.startswith(FILES_PATH):
+            self.send_error(404)
+            return
+        file_path = os.path.join(root, os.path.basename(path))
+        if not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+        st = os.stat(file_path)
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        if self._not_modified(etag, st.st_mtime):
+            return self._send(304, etag, st.st_mtime)
+        self._send(200, etag, st.st_mtime, st.st_size, "application/octet-stream")
+        with open(file_path, "rb") as f:
+            shutil.copyfileobj(f, self.wfile, 64 * 1024)
+
+
+def serve(root: str = FIXTURE_DIR, port: int = DEFAULT_PORT, background: bool = False) -> ThreadingHTTPServer:
+    """Start the fixture server; with `background` it runs in a daemon thread and is returned."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+    server.root = root
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    else:
+        server.serve_forever()
+    return server
+
+
+def index_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{INDEX_PATH}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--root", default=FIXTURE_DIR)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--generate", type=int, default=0, help="write this many synthetic reports first")
+    parser.add_argument("--rows", type=int, default=1000, help="rows per generated report")
+    args = parser.parse_args()
+    os.makedirs(args.root, exist_ok=True)
+    if args.generate:
+        make_fixture_reports(args.root, args.generate, args.rows)
+    print(f"Sirviendo {args.root} en http://127.0.0.1:{args.port}{INDEX_PATH}")
+    serve(args.root, args.port)
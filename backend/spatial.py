@@ -0,0 +1,80 @@
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+# Grid cell size in degrees (~28 km of latitude): a radius query visits a handful of cells
+CELL_DEG = 0.25
+LNG_CELLS = int(360 / CELL_DEG)
+
+
+def unit_vectors(lat: np.ndarray, lng: np.ndarray) -> np.ndarray:
+    lat_r, lng_r = np.radians(lat), np.radians(lng)
+    cos_lat = np.cos(lat_r)
+    return np.column_stack([cos_lat * np.cos(lng_r), cos_lat * np.sin(lng_r), np.sin(lat_r)])
+
+
+class GeoGrid:
+    """
+    Static spatial index over hospital coordinates.
+
+    Points are bucketed into CELL_DEG × CELL_DEG cells and stored sorted by cell key, so
+    each row of cells touched by a query is one contiguous slice found with binary search.
+    Distances are exact great-circle distances computed from unit-sphere vectors, only for
+    the points in those slices.
+    """
+
+    def __init__(self, lat: np.ndarray, lng: np.ndarray):
+        lat = np.asarray(lat, dtype=float)
+        lng = np.asarray(lng, dtype=float)
+        keys = self._cell(lat, lng)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self.xyz = unit_vectors(lat, lng)
+
+    @staticmethod
+    def _cell(lat, lng):
+        lat_cell = np.floor((np.asarray(lat) + 90.0) / CELL_DEG).astype(np.int64)
+        lng_cell = np.floor((np.asarray(lng) + 180.0) / CELL_DEG).astype(np.int64) % LNG_CELLS
+        return lat_cell * LNG_CELLS + lng_cell
+
+    def within(self, lat: float, lng: float, radius_km: float):
+        """Rows within `radius_km` of (lat, lng) and their distances in km."""
+        if len(self.keys) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        d_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        lat_lo, lat_hi = max(lat - d_lat, -90.0), min(lat + d_lat, 90.0)
+        # Widest longitude span is at the latitude closest to a pole
+        cos_edge = math.cos(math.radians(max(abs(lat_lo), abs(lat_hi))))
+        d_lng = 180.0 if cos_edge < 1e-9 else min(math.degrees(radius_km / EARTH_RADIUS_KM) / cos_edge, 180.0)
+
+        lat_cells = range(int((lat_lo + 90.0) // CELL_DEG), int((lat_hi + 90.0) // CELL_DEG) + 1)
+        if d_lng >= 180.0:
+            lng_ranges = [(0, LNG_CELLS - 1)]
+        else:
+            first = int(((lng - d_lng) + 180.0) // CELL_DEG)
+            last = int(((lng + d_lng) + 180.0) // CELL_DEG)
+            # Split the range when it crosses the antimeridian
+            if first < 0:
+                lng_ranges = [(first + LNG_CELLS, LNG_CELLS - 1), (0, last)]
+            elif last >= LNG_CELLS:
+                lng_ranges = [(first, LNG_CELLS - 1), (0, last - LNG_CELLS)]
+            else:
+                lng_ranges = [(first, last)]
+
+        slices = []
+        for lat_cell in lat_cells:
+            for lo, hi in lng_ranges:
+                start = np.searchsorted(self.keys, lat_cell * LNG_CELLS + lo, side="left")
+                stop = np.searchsorted(self.keys, lat_cell * LNG_CELLS + hi, side="right")
+                if stop > start:
+                    slices.append(self.order[start:stop])
+        if not slices:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+
+        rows = np.concatenate(slices)
+        center = unit_vectors(np.array([lat]), np.array([lng]))[0]
+        chord = np.linalg.norm(self.xyz[rows] - center, axis=1)
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chord / 2, 1.0))
+        inside = distance <= radius_km
+        return rows[inside], distance[inside]
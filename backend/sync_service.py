@@ -1,26 +1,170 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import hashlib
+import json
 import logging
+import os
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+
+import httpx
+from bs4 import BeautifulSoup
+
+from backend.metrics import SYNC_REPORTS
 
 # URL del portal del Ministerio de Sanidad (Lista de Espera)
-MINISTRY_URL = "https://www.sanidad.gob.es/estadEstudios/estadisticas/sisInfSanSNS/listasEspera.htm"
+# Se puede apuntar al servidor local de pruebas (backend/sns_fixture_server.py) con SANIRADAR_MINISTRY_URL
+MINISTRY_URL = os.environ.get(
+    "SANIRADAR_MINISTRY_URL",
+    "https://www.sanidad.gob.es/estadEstudios/estadisticas/sisInfSanSNS/listasEspera.htm",
+)
+
+REPORTS_DIR = os.path.join("data", "reports")
+MANIFEST_NAME = "manifest.json"
+REPORT_EXTENSIONS = (".xlsx", ".xls", ".csv", ".pdf")
+
+# Parallel downloads against the ministry; small so we stay a polite client
+DOWNLOAD_CONCURRENCY = 4
+STREAM_CHUNK = 64 * 1024
+TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+
+
+@dataclass
+class SyncResult:
+    downloaded: List[str] = field(default_factory=list)  # local paths of new or changed files
+    unchanged: List[str] = field(default_factory=list)  # URLs answered with 304
+    failed: List[str] = field(default_factory=list)
+    index_changed: bool = True
+
+
+def load_manifest(dest: str) -> Dict[str, dict]:
+    """Validators (ETag / Last-Modified) and local path of every URL fetched so far."""
+    path = os.path.join(dest, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(dest: str, manifest: Dict[str, dict]) -> None:
+    path = os.path.join(dest, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def conditional_headers(entry: Optional[dict]) -> Dict[str, str]:
+    headers = {}
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry and entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
 
-def check_for_new_reports():
+
+def find_report_links(html: str, base_url: str) -> List[str]:
+    """Absolute URLs of the report files linked from the listing page, in page order."""
+    soup = BeautifulSoup(html, "html.parser")
+    links = []
+    for a in soup.find_all("a", href=True):
+        url = urljoin(base_url, a["href"])
+        if urlparse(url).path.lower().endswith(REPORT_EXTENSIONS) and url not in links:
+            links.append(url)
+    return links
+
+
+def local_name(url: str) -> str:
     """
-    Simula la búsqueda de nuevos informes en el portal oficial.
-    En una implementación real, este script parsearía el HTML buscando links con fechas nuevas.
+    File name for a report: its own name plus a short hash of the whole URL, since yearly
+    folders on the portal reuse names (e.g. .../2023/Andalucia.xlsx and .../2024/Andalucia.xlsx).
     """
-    logging.info(f"[{datetime.now()}] Iniciando búsqueda automática de actualizaciones en el portal del SNS...")
-    
+    stem, ext = os.path.splitext(os.path.basename(urlparse(url).path))
+    return f"{stem}-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]}{ext}"
+
+
+async def download_report(client: httpx.AsyncClient, url: str, dest: str, manifest: Dict[str, dict],
+                          semaphore: asyncio.Semaphore, result: SyncResult) -> None:
+    """Stream one report to disk unless the server says our copy is still current."""
+    entry = manifest.get(url)
+    path = os.path.join(dest, local_name(url))
+    # Without the local file the validators are worthless: ask for the full body
+    headers = conditional_headers(entry) if entry and os.path.exists(path) else {}
+    async with semaphore:
+        try:
+            async with client.stream("GET", url, headers=headers) as response:
+                if response.status_code == 304:
+                    result.unchanged.append(url)
+                    return
+                response.raise_for_status()
+                tmp = path + ".part"
+                size = 0
+                with open(tmp, "wb") as f:
+                    async for chunk in response.aiter_bytes(STREAM_CHUNK):
+                        f.write(chunk)
+                        size += len(chunk)
+                os.replace(tmp, path)
+                # Copies saved under an older naming scheme would be parsed twice
+                stale = entry.get("path") if entry else None
+                if stale and stale != path and os.path.exists(stale):
+                    os.remove(stale)
+        except httpx.HTTPError as e:
+            logging.error(f"Error descargando {url}: {e}")
+            result.failed.append(url)
+            return
+
+    manifest[url] = {
+        "path": path,
+        "size": size,
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+        "fetched_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    result.downloaded.append(path)
+
+
+async def sync_reports(index_url: str = MINISTRY_URL, dest: str = REPORTS_DIR,
+                       concurrency: int = DOWNLOAD_CONCURRENCY,
+                       client: Optional[httpx.AsyncClient] = None) -> SyncResult:
+    """
+    Find the report links on the listing page and download the new or changed ones.
+
+    Every request is conditional (ETag / Last-Modified), so an unchanged portal costs one
+    304 for the listing page and nothing else. Downloads share one pooled client and run
+    concurrently up to `concurrency` at a time.
+    """
+    os.makedirs(dest, exist_ok=True)
+    manifest = load_manifest(dest)
+    result = SyncResult()
+    own_client = client is None
+    if own_client:
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        client = httpx.AsyncClient(timeout=TIMEOUT, limits=limits, follow_redirects=True)
     try:
-        # Aquí iría el código de scrapping real
-        # response = requests.get(MINISTRY_URL, timeout=10)
-        # soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Simulamos que detectamos que los datos actuales (2025) son los últimos disponibles
-        logging.info("Resultado: Los datos actuales (Cierre 2025) están al día. No se requiere actualización.")
-        return False, "2025"
-    except Exception as e:
-        logging.error(f"Error al conectar con el portal de Sanidad: {e}")
-        return False, None
+        index_entry = manifest.get(index_url)
+        response = await client.get(index_url, headers=conditional_headers(index_entry))
+        if response.status_code == 304 and index_entry and "links" in index_entry:
+            result.index_changed = False
+            links = index_entry["links"]
+        else:
+            response.raise_for_status()
+            links = find_report_links(response.text, str(response.url))
+            manifest[index_url] = {
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+                "links": links,
+            }
+
+        # Files are only re-requested when the listing changed or one was never fetched
+        pending = [url for url in links if result.index_changed or url not in manifest]
+        semaphore = asyncio.Semaphore(concurrency)
+        await asyncio.gather(*(download_report(client, url, dest, manifest, semaphore, result) for url in pending))
+    finally:
+        if own_client:
+            await client.aclose()
+        save_manifest(dest, manifest)
+    for outcome in ("downloaded", "unchanged", "failed"):
+        SYNC_REPORTS.inc(len(getattr(result, outcome)), outcome)
+    return result
+
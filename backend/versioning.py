@@ -0,0 +1,94 @@
+from typing import Iterable, Optional, Set
+
+from sqlalchemy import text
+
+DATASET_VERSION = "dataset_version"
+# Version of the schema upgrades applied (backend/schema.py) and of the seed loaded (backend/seed.py)
+SCHEMA_VERSION = "schema_version"
+SEED_VERSION = "seed_version"
+
+# Above this many changed hospitals a version logs no ids: readers rebuild instead of patching rows
+INCREMENTAL_LIMIT = 500
+# Versions kept in the datasetchange log; readers further behind than this rebuild
+CHANGELOG_KEEP = 1000
+
+
+def read_meta(conn, key: str) -> int:
+    """Value stored under `key`; 0 if it was never recorded."""
+    value = conn.execute(text("SELECT value FROM datasetmeta WHERE key = :key"), {"key": key}).scalar()
+    return value or 0
+
+
+def write_meta(conn, key: str, value: int) -> None:
+    conn.execute(
+        text(
+            "INSERT INTO datasetmeta (key, value) VALUES (:key, :value) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+        ),
+        {"key": key, "value": value},
+    )
+
+
+def read_version(conn) -> int:
+    """Current dataset version; 0 for a database that has never recorded one."""
+    return read_meta(conn, DATASET_VERSION)
+
+
+def bump_version(conn, changed_ids: Optional[Iterable[int]] = None) -> None:
+    """
+    Increment the dataset version. Call it inside the transaction that changes the data,
+    so readers never see new rows under the old version or the other way round.
+
+    `changed_ids` are the hospitals the transaction touched (empty if none): when there are
+    at most INCREMENTAL_LIMIT, they are logged under the new version so API processes patch
+    just those rows. Versions bumped without them make readers rebuild.
+    """
+    conn.execute(
+        text(
+            "INSERT INTO datasetmeta (key, value) VALUES (:key, 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        ),
+        {"key": DATASET_VERSION},
+    )
+    if changed_ids is None:
+        return
+    changed_ids = sorted({int(h_id) for h_id in changed_ids})
+    if len(changed_ids) > INCREMENTAL_LIMIT:
+        return
+    version = read_version(conn)
+    conn.execute(
+        text("INSERT OR REPLACE INTO datasetchange (version, hospital_ids) VALUES (:version, :ids)"),
+        {"version": version, "ids": ",".join(map(str, changed_ids))},
+    )
+    conn.execute(text("DELETE FROM datasetchange WHERE version <= :oldest"), {"oldest": version - CHANGELOG_KEEP})
+
+
+def read_changes(conn, after: int, upto: int) -> Optional[Set[int]]:
+    """
+    Hospitals changed by the versions after `after` up to `upto`, or None when any of them
+    logged no ids (or too many in total) and the whole dataset has to be reread.
+    """
+    if upto <= after or upto - after > CHANGELOG_KEEP:
+        return None
+    rows = conn.execute(
+        text("SELECT hospital_ids FROM datasetchange WHERE version > :after AND version <= :upto"),
+        {"after": after, "upto": upto},
+    ).scalars().all()
+    if len(rows) != upto - after:
+        return None
+    changed = {int(h_id) for ids in rows for h_id in ids.split(",") if h_id}
+    return changed if len(changed) <= INCREMENTAL_LIMIT else None
+
+
+def raise_version_above(conn, floor: int) -> None:
+    """
+    Make sure the version is greater than `floor`. Used before publishing a database
+    built elsewhere, so readers switching to it always see the version move forward.
+    """
+    conn.execute(
+        text(
+            "INSERT INTO datasetmeta (key, value) VALUES (:key, :value) "
+            "ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)"
+        ),
+        {"key": DATASET_VERSION, "value": floor + 1},
+    )
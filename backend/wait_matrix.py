@@ -0,0 +1,337 @@
+import copy
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, select
+
+from backend.database import active_db_path, make_read_engine
+from backend.models import Hospital, SpecialtyData, SPECIALTIES, normalize_str
+from backend.clusters import ClusterIndex
+from backend.rankings import RankingIndex
+from backend.spatial import GeoGrid
+from backend.versioning import read_changes, read_version
+from backend.wait_stats import WaitStats
+
+SPECIALTY_IDS = tuple(s["id"] for s in SPECIALTIES)
+SPECIALTY_INDEX = {sid: col for col, sid in enumerate(SPECIALTY_IDS)}
+
+HOSPITAL_FIELDS = ("id", "name_es", "name_en", "city", "lat", "lng", "wait", "trend")
+
+# How often readers look for data committed by other processes (e.g. load_data)
+VERSION_CHECK_INTERVAL = 2.0
+
+
+def fallback_modifier(specialty_id: str) -> int:
+    """Deterministic simulation fallback used when a hospital has no real data for a specialty."""
+    return len(specialty_id) % 7
+
+
+FALLBACK_MODIFIERS = np.array([fallback_modifier(sid) for sid in SPECIALTY_IDS], dtype=np.int32)
+
+
+# Hot queries, built once as Core statements so every execution reuses the compiled SQL
+_hospital = Hospital.__table__
+_specialty = SpecialtyData.__table__
+ALL_HOSPITALS = _hospital.select()
+HOSPITALS_BY_ID = _hospital.select().where(_hospital.c.id.in_(bindparam("ids", expanding=True)))
+# Newest first, so for duplicated (hospital, specialty) rows the oldest is applied last and wins
+_specialty_rows = select(_specialty.c.hospital_id, _specialty.c.specialty_id, _specialty.c.wait)
+ALL_SPECIALTY_ROWS = _specialty_rows.order_by(_specialty.c.id.desc())
+SPECIALTY_ROWS_BY_HOSPITAL = (
+    _specialty_rows.where(_specialty.c.hospital_id.in_(bindparam("ids", expanding=True)))
+    .order_by(_specialty.c.id.desc())
+)
+
+
+def hospital_records(conn, ids: Optional[Iterable[int]] = None) -> List[dict]:
+    """
+    Hospital rows as dicts: public fields plus the stored province key the matrix indexes
+    on. Read with Core, since building ORM objects dominated a cold start on big datasets.
+    """
+    result = conn.execute(ALL_HOSPITALS) if ids is None else conn.execute(HOSPITALS_BY_ID, {"ids": list(ids)})
+    keys = tuple(result.keys())
+    return [dict(zip(keys, row)) for row in result.all()]
+
+
+class WaitMatrix:
+    """
+    Read-only snapshot of every hospital and its wait for each of the SPECIALTIES.
+
+    `waits[row, col]` already holds the real SpecialtyData value when there is one and
+    `hospital.wait + len(specialty) % 7` otherwise, so answering a specialty query is a
+    single column lookup. Snapshots are never mutated; a data change builds a new one,
+    together with its WaitStats. `version` is the dataset version the snapshot was read at.
+    """
+
+    def __init__(self, hospitals: List[dict], waits: np.ndarray,
+                 extra: Optional[Dict[str, Dict[int, int]]] = None,
+                 stats: Optional[WaitStats] = None, version: int = 0,
+                 geometry: Optional[Tuple[GeoGrid, ClusterIndex]] = None):
+        self.version = version
+        self.hospitals = tuple({field: h[field] for field in HOSPITAL_FIELDS} for h in hospitals)
+        self.province_norm = tuple(h.get("province_norm") or normalize_str(h["city"]) for h in hospitals)
+        province_index: Dict[str, List[int]] = {}
+        for row, key in enumerate(self.province_norm):
+            province_index.setdefault(key, []).append(row)
+        self._province_index = {key: np.array(rows) for key, rows in province_index.items()}
+        self.ids = np.array([h["id"] for h in hospitals], dtype=np.int64)
+        self.base_wait = np.array([h["wait"] for h in hospitals], dtype=np.int32)
+        self.row_of = {h["id"]: row for row, h in enumerate(hospitals)}
+        if geometry is None:
+            lat = np.array([h["lat"] for h in hospitals], dtype=float)
+            lng = np.array([h["lng"] for h in hospitals], dtype=float)
+            geometry = (GeoGrid(lat, lng), ClusterIndex(lat, lng))
+        # Spatial indexes depend only on row order and coordinates
+        self.geo, self.clusters = geometry
+        self.waits = waits
+        self.waits.flags.writeable = False
+        # SpecialtyData rows whose specialty_id is not in SPECIALTIES: {specialty_id: {hospital_id: wait}}
+        self.extra = extra or {}
+        self.stats = stats if stats is not None else WaitStats.compute(self)
+        self._rankings: Optional[RankingIndex] = None
+        self._rankings_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.hospitals)
+
+    @classmethod
+    def build(cls, hospitals: Iterable[dict],
+              specialty_rows: Iterable[Tuple[int, str, int]], version: int = 0) -> "WaitMatrix":
+        hospitals = sorted(hospitals, key=lambda h: h["id"])
+        base = np.array([h["wait"] for h in hospitals], dtype=np.int32)
+        waits = base[:, None] + FALLBACK_MODIFIERS[None, :]
+        row_of = {h["id"]: row for row, h in enumerate(hospitals)}
+
+        rows, cols, values = [], [], []
+        extra: Dict[str, Dict[int, int]] = {}
+        # Rows arrive newest first so the oldest SpecialtyData wins, like the old `.first()` lookup
+        for hospital_id, specialty_id, wait in specialty_rows:
+            row = row_of.get(hospital_id)
+            if row is None:
+                continue
+            spec_col = SPECIALTY_INDEX.get(specialty_id)
+            if spec_col is None:
+                extra.setdefault(specialty_id, {})[hospital_id] = wait
+                continue
+            rows.append(row)
+            cols.append(spec_col)
+            values.append(wait)
+        if rows:
+            waits[np.array(rows), np.array(cols)] = np.array(values, dtype=np.int32)
+        return cls(hospitals, waits, extra, version=version)
+
+    @classmethod
+    def from_connection(cls, conn) -> "WaitMatrix":
+        version = read_version(conn)
+        return cls.build(hospital_records(conn), conn.execute(ALL_SPECIALTY_ROWS).all(), version)
+
+    def with_changes(self, hospitals: Iterable[dict],
+                     specialty_rows: Iterable[Tuple[int, str, int]],
+                     changed_ids: Iterable[int], version: int) -> "WaitMatrix":
+        """
+        New snapshot where the rows of `changed_ids` are replaced by `hospitals` (their
+        current state) and `specialty_rows`. Changed ids missing from `hospitals` were deleted.
+        """
+        changed_ids = set(changed_ids)
+        fresh = WaitMatrix.build(hospitals, specialty_rows)
+        keep = ~np.isin(self.ids, np.fromiter(changed_ids, dtype=np.int64, count=len(changed_ids)))
+
+        geometry = None
+        if keep.sum() + len(fresh) == len(self) and all(h_id in self.row_of for h_id in fresh.row_of):
+            # Same set of hospitals: patch the changed rows in a copy
+            hospitals = [dict(h, province_norm=p) for h, p in zip(self.hospitals, self.province_norm)]
+            waits = self.waits.copy()
+            moved = False
+            for fresh_row, h in enumerate(fresh.hospitals):
+                row = self.row_of[h["id"]]
+                old = self.hospitals[row]
+                moved = moved or (old["lat"], old["lng"]) != (h["lat"], h["lng"])
+                hospitals[row] = dict(h, province_norm=fresh.province_norm[fresh_row])
+                waits[row] = fresh.waits[fresh_row]
+            if not moved:
+                geometry = (self.geo, self.clusters)
+        else:
+            hospitals = [
+                dict(h, province_norm=p)
+                for h, p, kept in zip(self.hospitals, self.province_norm, keep) if kept
+            ] + [dict(h, province_norm=p) for h, p in zip(fresh.hospitals, fresh.province_norm)]
+            waits = np.vstack([self.waits[keep], fresh.waits])
+            order = np.argsort([h["id"] for h in hospitals], kind="stable")
+            hospitals = [hospitals[i] for i in order]
+            waits = waits[order]
+
+        extra = {}
+        for specialty_id in set(self.extra) | set(fresh.extra):
+            merged = {h_id: w for h_id, w in self.extra.get(specialty_id, {}).items() if h_id not in changed_ids}
+            merged.update(fresh.extra.get(specialty_id, {}))
+            if merged:
+                extra[specialty_id] = merged
+
+        matrix = WaitMatrix(hospitals, waits, extra, stats=self.stats, version=version, geometry=geometry)
+        matrix.stats = self.stats.updated(self, matrix, changed_ids)
+        return matrix
+
+    def relabeled(self, version: int) -> "WaitMatrix":
+        """Same data (and indexes) under a newer version, for versions that changed no hospital."""
+        matrix = copy.copy(self)
+        matrix.version = version
+        return matrix
+
+    @property
+    def rankings(self) -> RankingIndex:
+        """Sorted indexes for /api/rankings, built on first use (once per snapshot)."""
+        if self._rankings is None:
+            with self._rankings_lock:
+                if self._rankings is None:
+                    self._rankings = RankingIndex(self)
+        return self._rankings
+
+    def province_rows(self, province_norm: str) -> np.ndarray:
+        """Rows (in id order) of the hospitals whose normalized province matches."""
+        return self._province_index.get(province_norm, np.empty(0, dtype=np.int64))
+
+    def nearby(self, lat: float, lng: float, radius_km: float, k: int,
+               specialty: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows and distances of the `k` hospitals with the lowest wait within `radius_km`."""
+        rows, distance = self.geo.within(lat, lng, radius_km)
+        if len(rows) == 0:
+            return rows, distance
+        waits = self.column(specialty)[rows] if specialty and specialty != "all" else self.base_wait[rows]
+        if len(rows) > k:
+            # Keep every row tied with the k-th wait so the final sort can break ties by distance
+            kth = np.partition(waits, k - 1)[k - 1]
+            keep = waits <= kth
+            rows, distance, waits = rows[keep], distance[keep], waits[keep]
+        best = np.lexsort((self.ids[rows], distance, waits))[:k]
+        return rows[best], distance[best]
+
+    def column(self, specialty: str) -> np.ndarray:
+        """Wait of every hospital (in row order) for one specialty."""
+        spec_col = SPECIALTY_INDEX.get(specialty)
+        if spec_col is not None:
+            return self.waits[:, spec_col]
+        column = self.base_wait + fallback_modifier(specialty)
+        for hospital_id, wait in self.extra.get(specialty, {}).items():
+            column[self.row_of[hospital_id]] = wait
+        return column
+
+    def hospital_rows(self, rows: Optional[Iterable[int]] = None,
+                      specialty: Optional[str] = None) -> List[dict]:
+        """Hospital dicts for the given rows (all by default), with `wait` adjusted to the specialty."""
+        rows = range(len(self.hospitals)) if rows is None else rows
+        if not specialty or specialty == "all":
+            return [dict(self.hospitals[row]) for row in rows]
+        column = self.column(specialty)
+        return [dict(self.hospitals[row], wait=int(column[row])) for row in rows]
+
+
+class WaitMatrixStore:
+    """Holds the current WaitMatrix. Readers just grab the reference; writers swap it whole."""
+
+    def __init__(self):
+        self._matrix = WaitMatrix.build([], [])
+        self._lock = threading.Lock()
+        # Held while a background refresh runs, so there is at most one in flight
+        self._refreshing = threading.Lock()
+        self._checked_at = 0.0
+        self.engine = None
+        self.db_path = None
+
+    def get(self) -> WaitMatrix:
+        return self._matrix
+
+    def current(self) -> WaitMatrix:
+        """
+        The current matrix. At most every VERSION_CHECK_INTERVAL seconds a background thread
+        looks for a newer dataset version committed by another process, or another database
+        file published by the scheduler, and swaps in the refreshed matrix once it is built.
+        Requests never wait for it: they keep getting the previous snapshot until the swap.
+        """
+        now = time.monotonic()
+        if self.engine is not None and now - self._checked_at > VERSION_CHECK_INTERVAL:
+            self._checked_at = now
+            if self._refreshing.acquire(blocking=False):
+                threading.Thread(target=self._follow, name="wait-matrix-refresh", daemon=True).start()
+        return self._matrix
+
+    def _follow(self) -> None:
+        try:
+            path = os.path.normpath(active_db_path())
+            if path != self.db_path:
+                self.switch(path)
+                return
+            with self.engine.connect() as conn:
+                version = read_version(conn)
+            if version != self._matrix.version:
+                self.refresh(self.engine)
+        except Exception as e:
+            logging.error(f"No se pudo actualizar la matriz de esperas: {e}")
+        finally:
+            self._refreshing.release()
+
+    def switch(self, path: str) -> WaitMatrix:
+        """Serve the database at `path`: build its matrix first, then retire the old engine."""
+        engine = make_read_engine(path)
+        matrix = self.rebuild(engine)
+        old, self.engine, self.db_path = self.engine, engine, path
+        if old is not None:
+            old.dispose()
+        return matrix
+
+    def publish(self, matrix: WaitMatrix) -> None:
+        self._matrix = matrix
+
+    def rebuild(self, engine) -> WaitMatrix:
+        # Serialize rebuilds so two of them can't publish out of order
+        with self._lock:
+            with engine.connect() as conn:
+                matrix = WaitMatrix.from_connection(conn)
+            # Full loads sort the rankings up front; patched snapshots sort them on first request
+            matrix.rankings
+            self.publish(matrix)
+        return matrix
+
+    def refresh(self, engine) -> WaitMatrix:
+        """
+        Catch up with the database: patch in the hospitals the writers logged for each
+        version since ours (backend.versioning.bump_version), or rebuild when any version
+        logged none or too many.
+        """
+        with self._lock:
+            current = self._matrix
+            with engine.connect() as conn:
+                version = read_version(conn)
+                if version == current.version:
+                    return current
+                changed = read_changes(conn, current.version, version)
+                if changed is None:
+                    matrix = WaitMatrix.from_connection(conn)
+                    matrix.rankings
+                elif not changed:
+                    matrix = current.relabeled(version)
+                else:
+                    hospitals = hospital_records(conn, changed)
+                    specialty_rows = conn.execute(SPECIALTY_ROWS_BY_HOSPITAL, {"ids": list(changed)}).all()
+                    matrix = current.with_changes(hospitals, specialty_rows, changed, version)
+            self.publish(matrix)
+        return matrix
+
+
+store = WaitMatrixStore()
+
+
+def get_wait_matrix() -> WaitMatrix:
+    return store.current()
+
+
+def watch_database(path: str, read_engine) -> None:
+    """
+    Serve the database at `path` through `read_engine` (its read-only pool). Writers are
+    other processes (load_data, the scheduler): current() follows their version bumps.
+    """
+    store.engine = read_engine
+    store.db_path = os.path.normpath(path)
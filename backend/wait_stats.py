@@ -0,0 +1,100 @@
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from backend.wait_matrix import WaitMatrix
+
+
+class WaitStats:
+    """
+    Materialized aggregates over a WaitMatrix: per-specialty min, max and mean plus the
+    absolute min/max across every hospital × specialty pair.
+
+    Extremes are stored as (wait, hospital id) so ties resolve to the lowest id, which is
+    the first hospital the old row-by-row scan would have found.
+    """
+
+    def __init__(self, count: int, base_sum: int, spec_sum: np.ndarray,
+                 min_wait: np.ndarray, min_id: np.ndarray,
+                 max_wait: np.ndarray, max_id: np.ndarray):
+        self.count = count
+        self.base_sum = base_sum
+        self.spec_sum = spec_sum
+        self.min_wait = min_wait
+        self.min_id = min_id
+        self.max_wait = max_wait
+        self.max_id = max_id
+
+    @classmethod
+    def compute(cls, matrix: "WaitMatrix") -> "WaitStats":
+        n_specs = matrix.waits.shape[1]
+        if len(matrix) == 0:
+            empty = np.zeros(n_specs, dtype=np.int64)
+            return cls(0, 0, empty, empty.copy(), empty.copy(), empty.copy(), empty.copy())
+        min_rows = matrix.waits.argmin(axis=0)
+        max_rows = matrix.waits.argmax(axis=0)
+        cols = np.arange(n_specs)
+        return cls(
+            count=len(matrix),
+            base_sum=int(matrix.base_wait.sum()),
+            spec_sum=matrix.waits.sum(axis=0, dtype=np.int64),
+            min_wait=matrix.waits[min_rows, cols].astype(np.int64),
+            min_id=matrix.ids[min_rows],
+            max_wait=matrix.waits[max_rows, cols].astype(np.int64),
+            max_id=matrix.ids[max_rows],
+        )
+
+    def updated(self, old: "WaitMatrix", new: "WaitMatrix", changed_ids: Iterable[int]) -> "WaitStats":
+        """
+        Stats for `new`, derived from these stats of `old` where only `changed_ids` differ.
+
+        Sums are adjusted by the delta of the changed rows. A column is only rescanned when
+        the hospital holding its min or max was itself changed or removed.
+        """
+        changed_ids = list(changed_ids)
+        if len(new) == 0 or self.count == 0:
+            return WaitStats.compute(new)
+
+        old_rows = [old.row_of[h_id] for h_id in changed_ids if h_id in old.row_of]
+        new_rows = [new.row_of[h_id] for h_id in changed_ids if h_id in new.row_of]
+        old_block = old.waits[old_rows].astype(np.int64)
+        new_block = new.waits[new_rows].astype(np.int64)
+
+        spec_sum = self.spec_sum - old_block.sum(axis=0) + new_block.sum(axis=0)
+        base_sum = self.base_sum - int(old.base_wait[old_rows].sum()) + int(new.base_wait[new_rows].sum())
+        min_wait, min_id = self.min_wait.copy(), self.min_id.copy()
+        max_wait, max_id = self.max_wait.copy(), self.max_id.copy()
+
+        changed = np.array(changed_ids, dtype=np.int64)
+        stale_min = np.isin(min_id, changed)
+        stale_max = np.isin(max_id, changed)
+        for col in np.flatnonzero(stale_min):
+            row = int(new.waits[:, col].argmin())
+            min_wait[col], min_id[col] = new.waits[row, col], new.ids[row]
+        for col in np.flatnonzero(stale_max):
+            row = int(new.waits[:, col].argmax())
+            max_wait[col], max_id[col] = new.waits[row, col], new.ids[row]
+
+        ids = new.ids[new_rows]
+        for i, h_id in enumerate(ids):
+            values = new_block[i]
+            better = (values < min_wait) | ((values == min_wait) & (h_id < min_id))
+            min_wait[better], min_id[better] = values[better], h_id
+            worse = (values > max_wait) | ((values == max_wait) & (h_id < max_id))
+            max_wait[worse], max_id[worse] = values[worse], h_id
+
+        return WaitStats(len(new), base_sum, spec_sum, min_wait, min_id, max_wait, max_id)
+
+    def absolute_min(self) -> tuple:
+        """(wait, hospital id, column) of the lowest wait across every specialty."""
+        col = int(np.lexsort((self.min_id, self.min_wait))[0])
+        return int(self.min_wait[col]), int(self.min_id[col]), col
+
+    def absolute_max(self) -> tuple:
+        """(wait, hospital id, column) of the highest wait across every specialty."""
+        col = int(np.lexsort((self.max_id, -self.max_wait))[0])
+        return int(self.max_wait[col]), int(self.max_id[col]), col
+
+    def spec_mean(self, col: int) -> float:
+        return float(self.spec_sum[col]) / self.count
@@ -0,0 +1,80 @@
+"""
+Compara dos resultados de benchmarks.run y lista las regresiones.
+
+    python -m benchmarks.compare base.json nuevo.json [--threshold 0.2]
+
+Latencies, durations, memory and SQL counts are worse when they grow, throughputs when
+they shrink. Exits with status 1 if any metric got worse by more than the threshold, so
+it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Iterator, Tuple
+
+LOWER_IS_BETTER = ("_ms", "_s", "_mb", "_queries", "sql_per_request", "errors")
+HIGHER_IS_BETTER = ("_rps", "_per_s")
+# Single worst samples: kept in the results, too noisy to compare
+IGNORED = ("max_ms",)
+
+
+def flatten(tree: dict, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in tree.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield path, value
+
+
+def direction(path: str) -> int:
+    """+1 if a larger value is a regression, -1 if a smaller one is, 0 if not a metric."""
+    name = path.rsplit(".", 1)[-1]
+    if name in IGNORED:
+        return 0
+    if name.endswith(HIGHER_IS_BETTER):
+        return -1
+    if name.endswith(LOWER_IS_BETTER):
+        return 1
+    return 0
+
+
+def compare(base: dict, new: dict, threshold: float, floor_ms: float) -> Dict[str, Tuple[float, float, float]]:
+    """{metric: (base, new, relative change)} for the metrics that regressed past `threshold`."""
+    old = dict(flatten(base["sizes"]))
+    regressions = {}
+    for path, value in flatten(new["sizes"]):
+        sign = direction(path)
+        before = old.get(path)
+        if not sign or before is None or before == value:
+            continue
+        # Sub-`floor_ms` latencies are mostly scheduler noise
+        if path.endswith("_ms") and max(before, value) < floor_ms:
+            continue
+        change = (value - before) / before if before else float("inf")
+        if sign * change > threshold:
+            regressions[path] = (before, value, change)
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.20, help="relative change reported (0.20 = 20%%)")
+    parser.add_argument("--floor-ms", type=float, default=1.0, help="ignore latencies below this in both runs")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(base, new, args.threshold, args.floor_ms)
+    print(f"{base['meta'].get('commit')} -> {new['meta'].get('commit')}: {len(regressions)} regresiones")
+    for path, (before, value, change) in sorted(regressions.items()):
+        print(f"  {path}: {before} -> {value} ({change:+.0%})")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
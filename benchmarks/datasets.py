@@ -0,0 +1,133 @@
+"""
+Conjuntos de datos sintéticos a escala nacional para los benchmarks.
+
+Genera extractos con el formato de data/waiting_times_latest.csv (hospital, city,
+specialty, wait_days, last_month_wait, lat, lng): una fila general por centro y una
+por cada especialidad que ofrece. Los centros se reparten por provincia según su
+población y solo los grandes hospitales cubren la mayoría de las 42 especialidades,
+así que SpecialtyData queda dispersa como en los datos reales. Misma semilla, mismo
+fichero:
+
+    python -m benchmarks.datasets 10000 data/bench_10k.csv
+"""
+import argparse
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from backend.models import SPECIALTIES, SPECIALTY_ALIASES
+
+DEFAULT_SEED = 20240501
+
+# (province, lat, lng, population in thousands); names as in the PROVINCES list of the API
+PROVINCES = [
+    ("Álava", 42.85, -2.68, 335), ("Albacete", 38.99, -1.86, 388), ("Alicante", 38.35, -0.48, 1944),
+    ("Almería", 36.84, -2.46, 740), ("Asturias", 43.36, -5.85, 1006), ("Ávila", 40.66, -4.70, 158),
+    ("Badajoz", 38.88, -6.97, 665), ("Barcelona", 41.39, 2.17, 5715), ("Burgos", 42.34, -3.70, 357),
+    ("Cáceres", 39.47, -6.37, 389), ("Cádiz", 36.53, -6.29, 1246), ("Cantabria", 43.46, -3.80, 588),
+    ("Castellón", 39.99, -0.05, 597), ("Ciudad Real", 38.99, -3.93, 492), ("Córdoba", 37.89, -4.78, 775),
+    ("A Coruña", 43.36, -8.41, 1122), ("Cuenca", 40.07, -2.14, 196), ("Girona", 41.98, 2.82, 800),
+    ("Granada", 37.18, -3.60, 925), ("Guadalajara", 40.63, -3.17, 270), ("Guipúzcoa", 43.32, -1.98, 727),
+    ("Huelva", 37.26, -6.95, 528), ("Huesca", 42.14, -0.41, 225), ("Islas Baleares", 39.57, 2.65, 950),
+    ("Ibiza", 38.91, 1.43, 150), ("Menorca", 39.89, 4.26, 96), ("Formentera", 38.70, 1.45, 12),
+    ("Jaén", 37.78, -3.79, 621), ("León", 42.60, -5.57, 451), ("Lleida", 41.62, 0.62, 442),
+    ("Lugo", 43.01, -7.56, 326), ("Madrid", 40.42, -3.70, 6871), ("Málaga", 36.72, -4.42, 1717),
+    ("Murcia", 37.99, -1.13, 1531), ("Navarra", 42.82, -1.64, 672), ("Ourense", 42.34, -7.86, 305),
+    ("Palencia", 42.01, -4.53, 159), ("Las Palmas", 28.12, -15.43, 850), ("Lanzarote", 28.96, -13.55, 156),
+    ("Fuerteventura", 28.50, -13.86, 120), ("Pontevedra", 42.43, -8.64, 944), ("La Rioja", 42.47, -2.45, 320),
+    ("Salamanca", 40.97, -5.66, 327), ("Segovia", 40.95, -4.12, 154), ("Sevilla", 37.39, -5.98, 1947),
+    ("Soria", 41.76, -2.46, 89), ("Tarragona", 41.12, 1.25, 831), ("Santa Cruz de Tenerife", 28.47, -16.25, 931),
+    ("La Palma", 28.68, -17.76, 83), ("La Gomera", 28.09, -17.11, 22), ("El Hierro", 27.81, -17.91, 11),
+    ("Teruel", 40.34, -1.11, 134), ("Toledo", 39.86, -4.02, 709), ("Valencia", 39.47, -0.38, 2630),
+    ("Valladolid", 41.65, -4.72, 519), ("Vizcaya", 43.26, -2.93, 1154), ("Zamora", 41.50, -5.75, 168),
+    ("Zaragoza", 41.65, -0.89, 972), ("Ceuta", 35.89, -5.32, 83), ("Melilla", 35.29, -2.94, 85),
+]
+
+# (kind of centre, share of centres, share of the 42 specialties it usually offers)
+CENTRE_KINDS = [
+    ("Hospital Universitario", 0.05, 0.70),
+    ("Hospital", 0.20, 0.35),
+    ("Centro de Especialidades", 0.45, 0.10),
+    ("Clínica", 0.30, 0.05),
+]
+
+# Offered by almost every centre with outpatient consultations; the rest only by hospitals
+COMMON_SPECIALTIES = {
+    "trauma", "ophthalmology", "dermo", "gyn", "ent", "urology", "cardio", "digestive",
+    "general-surgery", "rehab", "neurology", "family-medicine", "pediatrics", "radiology",
+}
+
+
+def specialty_names() -> Dict[str, str]:
+    """Spanish name of each specialty as an extract would spell it (first alias listed)."""
+    names = {}
+    for alias, specialty_id in SPECIALTY_ALIASES.items():
+        names.setdefault(specialty_id, alias.capitalize())
+    return names
+
+
+def generate(centres: int, seed: int = DEFAULT_SEED) -> pd.DataFrame:
+    """Extract rows for `centres` centres: one general row each plus one per specialty offered."""
+    rng = np.random.default_rng(seed)
+    spec_ids = [s["id"] for s in SPECIALTIES]
+    names = specialty_names()
+
+    names_p, lat_p, lng_p, population = zip(*PROVINCES)
+    province = rng.choice(len(PROVINCES), size=centres, p=np.array(population) / sum(population))
+    kind = rng.choice(len(CENTRE_KINDS), size=centres, p=[share for _, share, _ in CENTRE_KINDS])
+    lat = np.round(np.array(lat_p)[province] + rng.normal(0, 0.25, centres), 5)
+    lng = np.round(np.array(lng_p)[province] + rng.normal(0, 0.25, centres), 5)
+
+    # Each specialty has its own typical wait, each province runs slower or faster than the rest
+    spec_mean = rng.uniform(20, 120, len(spec_ids))
+    province_factor = rng.lognormal(0, 0.25, len(PROVINCES))
+    weight = np.array([3.0 if sid in COMMON_SPECIALTIES else 1.0 for sid in spec_ids])
+    coverage = np.array([offered for _, _, offered in CENTRE_KINDS])[kind]
+    # Chance that a centre offers each specialty: its coverage, tilted towards the common ones
+    offer_p = np.clip(coverage[:, None] * weight[None, :] / weight.mean(), 0, 1)
+    offers = rng.random((centres, len(spec_ids))) < offer_p
+
+    waits = spec_mean[None, :] * province_factor[province][:, None] * rng.lognormal(0, 0.35, offers.shape)
+    waits = np.clip(np.round(waits), 1, 365).astype(int)
+    last_month = np.clip(np.round(waits * rng.normal(1, 0.1, offers.shape)), 1, 365).astype(int)
+    # The hospital-level figure is the mean over what the centre offers (its typical wait otherwise)
+    offered = offers.sum(axis=1)
+    general = np.where(offered > 0, (waits * offers).sum(axis=1) / np.maximum(offered, 1), waits.mean(axis=1))
+    general = np.clip(np.round(general), 1, 365).astype(int)
+
+    hospital = [f"{CENTRE_KINDS[k][0]} {names_p[p]} {i + 1:06d}" for i, (k, p) in enumerate(zip(kind, province))]
+    city = [names_p[p] for p in province]
+    rows, cols = np.nonzero(offers)
+    frames: List[pd.DataFrame] = [
+        pd.DataFrame({
+            "hospital": hospital, "city": city, "specialty": "", "wait_days": general,
+            "last_month_wait": np.clip(np.round(general * rng.normal(1, 0.1, centres)), 1, 365).astype(int),
+            "lat": lat, "lng": lng,
+        }),
+        pd.DataFrame({
+            "hospital": np.array(hospital, dtype=object)[rows], "city": np.array(city, dtype=object)[rows],
+            "specialty": [names[spec_ids[c]] for c in cols], "wait_days": waits[rows, cols],
+            "last_month_wait": last_month[rows, cols], "lat": lat[rows], "lng": lng[rows],
+        }),
+    ]
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_csv(path: str, centres: int, seed: int = DEFAULT_SEED) -> int:
+    """Write the dataset to `path` and return its row count."""
+    frame = generate(centres, seed)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    frame.to_csv(path, index=False)
+    return len(frame)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("centres", type=int)
+    parser.add_argument("path")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+    rows = write_csv(args.path, args.centres, args.seed)
+    print(f"{args.path}: {args.centres} centros, {rows} filas")
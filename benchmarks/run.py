@@ -0,0 +1,369 @@
+"""
+Benchmarks de la API con conjuntos sintéticos de 1k, 10k y 100k centros.
+
+    python -m benchmarks.run                                  # 1k, 10k y 100k
+    python -m benchmarks.run --sizes 1000 --requests 50       # pasada rápida
+    python -m benchmarks.compare base.json benchmarks/results/<fichero>.json
+
+Each size gets its own working directory and fresh processes, so nothing is shared
+between sizes or with data/: one process generates the extract (benchmarks.datasets)
+and ingests it with load_hospitals_from_csv; another starts the API, drives every
+/api/* endpoint in-process (ASGI, counting SQL statements) and then over HTTP against
+a uvicorn server, at each concurrency level. Results go to benchmarks/results/ as JSON.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+from benchmarks.datasets import DEFAULT_SEED, PROVINCES, write_csv
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+SEED_DIR = os.path.join(REPO_ROOT, "data", "seed")
+EXTRACT = os.path.join("data", "bench_extract.csv")
+
+SIZES = (1_000, 10_000, 100_000)
+REQUESTS = 200
+CONCURRENCY = (1, 8, 32)
+# Cases that return the whole dataset run a tenth of the requests
+BULK_SHARE = 10
+# Parameter sets each case cycles through, so caches see more than one key
+VARIANTS = 16
+# Whole peninsula, then roughly Madrid, for /api/clusters
+CLUSTER_VIEWS = (("-9.5,35.8,4.4,43.9", 6), ("-4.2,40.2,-3.4,40.7", 10))
+
+Request = Tuple[str, Dict[str, object]]
+
+
+class QueryCounter:
+    """SQL statements executed by every engine in the process (writer, readers, ingest)."""
+
+    def __init__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        self.count = 0
+        event.listen(Engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def peak_rss_mb(who: str = "self") -> Optional[float]:
+    """Peak resident memory of this process (or of its largest finished child), in MB."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(usage.ru_maxrss / scale, 1)
+
+
+def summarize(latencies: Sequence[float], wall: float, errors: int) -> dict:
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (0, 0, 0)
+    return {
+        "requests": len(ms), "errors": errors,
+        "p50_ms": round(float(p50), 3), "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(ms.mean()), 3) if len(ms) else 0, "max_ms": round(float(ms.max()), 3) if len(ms) else 0,
+        "throughput_rps": round(len(ms) / wall, 1) if wall else 0,
+    }
+
+
+def endpoint_cases(matrix, seed: int = DEFAULT_SEED) -> Dict[str, Tuple[bool, List[Request]]]:
+    """{case: (bulk, requests to cycle through)} covering every /api/* endpoint."""
+    from backend.wait_matrix import SPECIALTY_IDS
+
+    rng = random.Random(seed)
+    ids = matrix.ids.tolist()
+    provinces = [name for name, *_ in PROVINCES]
+
+    def variants(make) -> List[Request]:
+        return [(path, {k: v for k, v in params.items() if v is not None}) for path, params in
+                (make() for _ in range(VARIANTS))]
+
+    return {
+        "specialties": (False, [("/api/specialties", {})]),
+        "provinces": (False, [("/api/provinces", {})]),
+        "hospitals": (True, [("/api/hospitals", {})]),
+        "hospitals_filtered": (False, variants(lambda: ("/api/hospitals", {
+            "specialty": rng.choice(SPECIALTY_IDS), "province": rng.choice(provinces)}))),
+        "hospitals_page": (False, variants(lambda: ("/api/hospitals", {
+            "fields": "id,lat,lng,wait", "limit": 500, "cursor": rng.choice(ids)}))),
+        "hospitals_ndjson": (False, variants(lambda: ("/api/hospitals", {
+            "format": "ndjson", "province": rng.choice(provinces)}))),
+        "nearby": (False, variants(lambda: ("/api/hospitals/nearby", {
+            "lat": round(rng.uniform(36.5, 43.5), 4), "lng": round(rng.uniform(-8.5, 2.5), 4),
+            "radius_km": 50, "specialty": rng.choice(SPECIALTY_IDS)}))),
+        "clusters": (False, variants(lambda: ("/api/clusters", dict(
+            zip(("bbox", "zoom"), rng.choice(CLUSTER_VIEWS)), specialty=rng.choice(SPECIALTY_IDS))))),
+        "stats": (False, variants(lambda: ("/api/stats", {"specialty": rng.choice((None, *SPECIALTY_IDS))}))),
+        "matrix": (True, [("/api/matrix", {})]),
+        "rankings": (False, variants(lambda: ("/api/rankings", {
+            "specialty": rng.choice(("all", *SPECIALTY_IDS)), "province": rng.choice((None, *provinces)),
+            "order": rng.choice(("asc", "desc")), "k": 10}))),
+        "rankings_hospital": (False, variants(lambda: ("/api/rankings", {
+            "specialty": rng.choice(SPECIALTY_IDS), "hospital_id": rng.choice(ids), "k": 1}))),
+        "history": (False, variants(lambda: ("/api/history", {"hospital_id": rng.choice((None, *ids))}))),
+    }
+
+
+async def drive(client, requests: List[Request], total: int, concurrency: int) -> dict:
+    """Send `total` requests, cycling through `requests`, from `concurrency` concurrent workers."""
+    latencies: List[float] = []
+    errors = 0
+    next_index = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for i in next_index:
+            path, params = requests[i % len(requests)]
+            start = time.perf_counter()
+            response = await client.get(path, params=params)
+            await response.aread()
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code >= 400
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+async def measure(client, cases, requests: int, concurrency: Sequence[int],
+                  counter: Optional[QueryCounter] = None) -> dict:
+    results = {}
+    for name, (bulk, case_requests) in cases.items():
+        total = max(requests // BULK_SHARE, 10) if bulk else requests
+        start = time.perf_counter()
+        path, params = case_requests[0]
+        await (await client.get(path, params=params)).aread()
+        results[name] = {"cold_ms": round((time.perf_counter() - start) * 1000, 3), "concurrency": {}}
+        for level in concurrency:
+            before = counter.count if counter else 0
+            stats = await drive(client, case_requests, total, level)
+            if counter:
+                stats["sql_per_request"] = round((counter.count - before) / total, 2)
+            results[name]["concurrency"][str(level)] = stats
+    return results
+
+
+def stage_ingest(centres: int, seed: int) -> dict:
+    start = time.perf_counter()
+    rows = write_csv(EXTRACT, centres, seed)
+    generate_s = time.perf_counter() - start
+
+    from backend import load_data
+
+    counter = QueryCounter()
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        load_data.load_hospitals_from_csv(EXTRACT)
+        ingest_s = time.perf_counter() - start
+        queries = counter.count
+        # Same extract again: every row takes the update path of the upserts
+        start = time.perf_counter()
+        load_data.load_hospitals_from_csv(EXTRACT)
+        reingest_s = time.perf_counter() - start
+    load_data.engine.dispose()
+    return {
+        "centres": centres, "rows": rows, "generate_s": round(generate_s, 3),
+        "ingest_s": round(ingest_s, 3), "ingest_rows_per_s": round(rows / ingest_s),
+        "ingest_queries": queries, "reingest_s": round(reingest_s, 3),
+        "db_mb": round(os.path.getsize(os.path.join("data", "saniradar.db")) / 2 ** 20, 1),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int) -> Tuple[subprocess.Popen, float]:
+    """uvicorn on `port`; returns it with the ms from spawn to the first answered request."""
+    import httpx
+
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=stage_env(),
+    )
+    while True:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/api/specialties").status_code == 200:
+                return server, round((time.perf_counter() - start) * 1000, 1)
+        except httpx.TransportError:
+            if server.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            time.sleep(0.02)
+
+
+def stage_serve(requests: int, concurrency: Sequence[int], seed: int) -> dict:
+    import httpx
+    from fastapi.testclient import TestClient
+
+    start = time.perf_counter()
+    from backend import main
+    from backend.wait_matrix import get_wait_matrix
+    import_ms = (time.perf_counter() - start) * 1000
+
+    counter = QueryCounter()
+    with TestClient(main.app) as client:
+        startup_ms = (time.perf_counter() - start) * 1000
+        client.get("/api/hospitals")
+        first_response_ms = (time.perf_counter() - start) * 1000
+        cases = endpoint_cases(get_wait_matrix(), seed)
+
+        async def in_process():
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as asgi:
+                return await measure(asgi, cases, requests, concurrency, counter)
+
+        in_process_results = asyncio.run(in_process())
+    in_process_rss = peak_rss_mb()
+
+    port = free_port()
+    server, http_startup_ms = start_server(port)
+    try:
+        async def over_http():
+            limits = httpx.Limits(max_connections=max(concurrency), max_keepalive_connections=max(concurrency))
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as http:
+                return await measure(http, cases, requests, concurrency)
+
+        http_results = asyncio.run(over_http())
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "startup": {
+            "import_ms": round(import_ms, 1), "startup_ms": round(startup_ms, 1),
+            "first_response_ms": round(first_response_ms, 1), "http_startup_ms": http_startup_ms,
+        },
+        "in_process": in_process_results,
+        "http": http_results,
+        "memory": {"in_process_peak_rss_mb": in_process_rss, "http_server_peak_rss_mb": peak_rss_mb("children")},
+    }
+
+
+def stage_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [REPO_ROOT, env.get("PYTHONPATH")]))
+    return env
+
+
+def run_stage(stage: str, workdir: str, args: argparse.Namespace, *extra: str) -> dict:
+    """Run one stage in a new process inside `workdir` and return what it measured."""
+    output = os.path.join(workdir, f"{stage}.json")
+    subprocess.run(
+        [sys.executable, "-m", "benchmarks.run", "--stage", stage, "--stage-output", output,
+         "--seed", str(args.seed), *extra],
+        cwd=workdir, env=stage_env(), check=True,
+    )
+    with open(output) as f:
+        return json.load(f)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args: argparse.Namespace) -> dict:
+    results = {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "seed": args.seed, "requests": args.requests, "concurrency": args.concurrency,
+        },
+        "sizes": {},
+    }
+    for size in args.sizes:
+        workdir = tempfile.mkdtemp(prefix=f"saniradar-bench-{size}-", dir=args.workdir)
+        try:
+            shutil.copytree(SEED_DIR, os.path.join(workdir, "data", "seed"))
+            print(f"[{size} centros] ingesta...", flush=True)
+            ingest = run_stage("ingest", workdir, args, "--size", str(size))
+            print(f"[{size} centros] API...", flush=True)
+            serve = run_stage("serve", workdir, args, "--requests", str(args.requests),
+                              "--concurrency", *map(str, args.concurrency))
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+        serve["memory"]["ingest_peak_rss_mb"] = ingest.pop("peak_rss_mb")
+        results["sizes"][str(size)] = {"ingest": ingest, **serve}
+        print_summary(size, results["sizes"][str(size)])
+    return results
+
+
+def print_summary(size: int, result: dict) -> None:
+    ingest, startup = result["ingest"], result["startup"]
+    print(f"  ingesta {ingest['ingest_s']}s ({ingest['ingest_rows_per_s']} filas/s), "
+          f"arranque {startup['http_startup_ms']} ms, RSS servidor {result['memory']['http_server_peak_rss_mb']} MB")
+    top = str(max(int(level) for level in next(iter(result["http"].values()))["concurrency"]))
+    print(f"  {'endpoint':<20}{'p50 ms':>10}{'p99 ms':>10}{'rps @' + top:>12}{'sql/req':>9}")
+    for name, case in result["in_process"].items():
+        base = case["concurrency"]["1"] if "1" in case["concurrency"] else next(iter(case["concurrency"].values()))
+        http = result["http"][name]["concurrency"][top]
+        print(f"  {name:<20}{base['p50_ms']:>10}{base['p99_ms']:>10}{http['throughput_rps']:>12}{base['sql_per_request']:>9}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="centres per dataset")
+    parser.add_argument("--requests", type=int, default=REQUESTS, help="requests per endpoint and level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(CONCURRENCY))
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", help=f"results file (default: {RESULTS_DIR}/<date>-<commit>.json)")
+    parser.add_argument("--workdir", help="where the per-size directories are created (default: system temp)")
+    parser.add_argument("--keep", action="store_true", help="keep the per-size directories")
+    parser.add_argument("--stage", choices=("ingest", "serve"), help=argparse.SUPPRESS)
+    parser.add_argument("--stage-output", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        if args.stage == "ingest":
+            result = stage_ingest(args.size, args.seed)
+        else:
+            result = stage_serve(args.requests, args.concurrency, args.seed)
+        with open(args.stage_output, "w") as f:
+            json.dump(result, f)
+        return
+
+    results = run(args)
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{results['meta']['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Resultados guardados en {output}")
+
+
+if __name__ == "__main__":
+    main()